@@ -1,127 +1,161 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, Response, g, render_template, request, jsonify, redirect, url_for, session, flash
 import os
-from dotenv import load_dotenv
 import json
-import requests
-from huggingface_hub import InferenceClient
+import io
 import csv
+import codecs
+import hashlib
+import threading
+import time
+import atexit
+from collections import OrderedDict
 from functools import wraps
-from datetime import datetime
-
-# Load environment variables from .env file
-load_dotenv()
-
-# we will store and read from tasks.csv
-DATA_FILE = 'tasks.csv'
-USERS_FILE = 'users.csv'
+from task_model import TASK_FIELDS, Task, format_duration, intern_text
+from task_store import TaskStore
+from storage import make_storage, migrate_csv_to_sqlite, split_tasks_into_shards, journal_put, journal_delete
+from persistence import GroupCommitWriter
+from user_directory import UserDirectory
+from generation import generate_ai_result, decomposition_cache, model_calls, warm_up
+from generation_cache import normalize_context
+from jobs import JobQueue, JobRejected
+from events import make_change_bus
+from assets import IMMUTABLE_CACHE_CONTROL, build_assets
+import metrics
+from metrics import Callback, Counter, Histogram
+from profiling import RequestProfiler
 
 # Secret key for session
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
 
 #############################
-# 1) CSV Helper Functions   #
+# 1) Storage Helpers        #
 #############################
 
-# Update the CSV file path and field names
-DATA_FILE = 'tasks.csv'
-
-def load_tasks_from_csv(username=None):
-    tasks = []
-    if not os.path.exists(DATA_FILE):
-        return tasks
-    with open(DATA_FILE, 'r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            # Only load tasks for the current user if username is provided
-            if username and row.get('username') != username:
-                continue
-            try:
-                # Handle empty or invalid values with safe conversion
-                task_id = row.get('id', '0')
-                task_id = int(task_id) if task_id.strip() else 0
-                
-                parent_id = row.get('parent_id', '0')
-                parent_id = int(parent_id) if parent_id.strip() else 0
-                
-                level = row.get('level', '0')
-                level = int(level) if level.strip() else 0
-                
-                tasks.append({
-                    'id': task_id,
-                    'parent_id': parent_id,
-                    'text': row.get('text', ''),
-                    'level': level,
-                    'completed': row.get('completed', 'False').lower() == 'true',
-                    'currentEmotion': row.get('currentEmotion', ''),
-                    'completionEmotion': row.get('completionEmotion', ''),
-                    'totalTimeEstimate': row.get('totalTimeEstimate', ''),
-                    'createdAt': row.get('createdAt', ''),
-                    'startTime': row.get('startTime', ''),
-                    'endTime': row.get('endTime', ''),
-                    'timeSpent': row.get('timeSpent', ''),
-                    'username': row.get('username', '')
-                })
-            except Exception as e:
-                print(f"Error loading task from CSV: {e}. Skipping row: {row}")
-                continue
-    return tasks
-
-def write_tasks_to_csv(tasks):
-    fieldnames = ['id', 'parent_id', 'text', 'level', 'completed', 'currentEmotion', 'completionEmotion', 'totalTimeEstimate', 'createdAt', 'startTime', 'endTime', 'timeSpent', 'username']
-    with open(DATA_FILE, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        for task in tasks:
-            writer.writerow({
-                'id': task['id'],
-                'parent_id': task['parent_id'],
-                'text': task['text'],
-                'level': task['level'],
-                'completed': str(task['completed']),
-                'currentEmotion': task.get('currentEmotion', ''),
-                'completionEmotion': task.get('completionEmotion', ''),
-                'totalTimeEstimate': task.get('totalTimeEstimate', ''),
-                'createdAt': task.get('createdAt', ''),
-                'startTime': task.get('startTime', ''),
-                'endTime': task.get('endTime', ''),
-                'timeSpent': task.get('timeSpent', ''),
-                'username': task.get('username', '')
-            })
+# These are set up by init_runtime() on the first request in each process,
+# so importing the app does no I/O and starts no threads, and gunicorn can
+# fork workers from a preloaded copy.
+# tasks.csv/users.csv by default, or SQLite with STORAGE_BACKEND=sqlite
+storage = None
+# Users are looked up in memory; the table is only re-read when it changes on disk
+users = None
+# The in-memory task table; each user's tasks are loaded the first time they're needed
+task_store = None
+# Writes are grouped and done by one thread; see persistence.py
+task_writer = None
+# Task changes for the /tasks/events streams, shared with the other workers; see events.py
+change_bus = None
+# Fingerprinted copies of static/ that url_for('static', ...) points to; see assets.py
+assets = None
+runtime_lock = threading.Lock()
+
+# Held while changing task_store and writing the change out
+task_lock = threading.RLock()
+MAX_BATCH_OPERATIONS = int(os.getenv('MAX_BATCH_OPERATIONS', '500'))
+
+def persist_tasks(tasks):
+    """Save new or changed tasks."""
+    return persist_changes(tasks, [])
+
+def persist_changes(tasks, deletions):
+    """Queue changed tasks and (username, ids) deletions for the writer thread.
+
+    Returns the waiter to pass to task_writer.wait() with PERSIST_SYNC=1
+    (None otherwise); wait after releasing task_lock, so other requests can
+    queue their changes into the same write.
+    """
+    task_store.touch(tasks)
+    records = journal_put(tasks)
+    for username, task_ids in deletions:
+        records.extend(journal_delete(username, task_ids))
+    waiter = task_writer.enqueue(records)
+    publish_changes(tasks, deletions)
+    return waiter
+
+def publish_changes(tasks, deletions):
+    """Send each user's changed tasks and deleted ids to their /tasks/events streams."""
+    changes = {}
+    for task in tasks:
+        changes.setdefault(task.username, ([], []))[0].append(task.to_json())
+    for username, task_ids in deletions:
+        changes.setdefault(username, ([], []))[1].extend(sorted(task_ids))
+    for username, (changed, deleted) in changes.items():
+        change_bus.publish(username, {'version': task_store.user_version(username),
+                                      'tasks': changed, 'deleted': deleted})
+
+storage_load_seconds = Histogram('storage_load_seconds', 'Time to load tasks from storage',
+                                 span='storage_load')
+
+def load_tasks(username):
+    with storage_load_seconds.time():
+        return storage.load_tasks(username)
+
+def new_task_store():
+    return TaskStore(loader=load_tasks, per_user=storage.per_user_loads)
+
+def init_runtime():
+    global storage, users, task_store, task_writer, change_bus, assets
+    with runtime_lock:
+        if task_writer is not None:
+            return
+        # .env holds credentials read when a request needs them
+        # (HUGGINGFACE_API_TOKEN); settings read at import time come from
+        # the environment itself
+        from dotenv import load_dotenv
+        load_dotenv()
+        storage = make_storage()
+        users = UserDirectory(storage)
+        task_store = new_task_store()
+        change_bus = make_change_bus()
+        assets = build_assets(app.static_folder)
+        # Assigned last: the other threads take a set task_writer to mean we're done
+        task_writer = GroupCommitWriter(storage)
+        atexit.register(task_writer.close)
+
+def refresh_tasks():
+    """Reload task_store only if another process wrote tasks since we last looked."""
+    global task_store
+    with task_lock:
+        if task_writer.stale():
+            # Our own queued changes have to land before we re-read the store
+            task_writer.flush()
+            task_store = new_task_store()
+            task_writer.mark_loaded()
+
+def allocate_task_ids(username, count):
+    """First of count fresh ids from the store's shared sequence.
+
+    The floor covers a sequence that is missing or behind the data, e.g.
+    after restoring an old tasks.csv: nothing below what we've loaded,
+    which always includes this user's tasks.
+    """
+    task_store.load_user(username)
+    return storage.allocate_task_ids(count, task_store.high_water + 1)
+
+def count_ai_result_rows(ai_result):
+    count = 1
+    for sub in ai_result.get('subTasks') or []:
+        count += 1 + len(sub.get('steps') or [])
+    return count
 
 def convert_ai_result_to_csv_rows(ai_result, username):
     rows = []
-    # Calculate a unique starting ID
-    try:
-        # Safely calculate the max ID with error handling
-        new_id_base = 1  # Default starting ID if no tasks exist or an error occurs
-        if task_list:
-            valid_ids = [t['id'] for t in task_list if isinstance(t['id'], int)]
-            if valid_ids:
-                new_id_base = max(valid_ids) + 1
-    except Exception as e:
-        print(f"Error calculating new ID: {e}. Using default ID 1.")
-        new_id_base = 1
-        
-    main_task_id = new_id_base
-    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # One block of ids for the whole tree, handed out in the same order as before
+    main_task_id = allocate_task_ids(username, count_ai_result_rows(ai_result))
+    created_at = int(time.time())
     
     # Main task row (level 0)
-    main_row = {
-        'id': main_task_id,
-        'parent_id': 0,
-        'text': ai_result['taskTitle'],
-        'level': 0,
-        'completed': False,
-        'currentEmotion': json.dumps(ai_result.get('currentEmotion', [])),
-        'completionEmotion': json.dumps(ai_result.get('completionEmotion', [])),
-        'totalTimeEstimate': ai_result.get('totalTimeEstimate', ''),
-        'createdAt': created_at,
-        'startTime': '',
-        'endTime': '',
-        'timeSpent': '',
-        'username': username
-    }
+    main_row = Task(
+        main_task_id,
+        parent_id=0,
+        text=ai_result['taskTitle'],
+        level=0,
+        currentEmotion=json.dumps(ai_result.get('currentEmotion', [])),
+        completionEmotion=json.dumps(ai_result.get('completionEmotion', [])),
+        totalTimeEstimate=ai_result.get('totalTimeEstimate', ''),
+        createdAt=created_at,
+        username=username
+    )
     rows.append(main_row)
     
     next_id = main_task_id + 1
@@ -129,110 +163,33 @@ def convert_ai_result_to_csv_rows(ai_result, username):
         for sub in ai_result['subTasks']:
             subtask_id = next_id
             next_id += 1
-            sub_row = {
-                'id': subtask_id,
-                'parent_id': main_task_id,
-                'text': sub['title'],
-                'level': 1,
-                'completed': False,
-                'currentEmotion': '',
-                'completionEmotion': '',
-                'totalTimeEstimate': sub.get('totalTimeEstimate', ''),
-                'createdAt': created_at,
-                'startTime': '',
-                'endTime': '',
-                'timeSpent': '',
-                'username': username
-            }
+            sub_row = Task(
+                subtask_id,
+                parent_id=main_task_id,
+                text=sub['title'],
+                level=1,
+                totalTimeEstimate=sub.get('totalTimeEstimate', ''),
+                createdAt=created_at,
+                username=username
+            )
             rows.append(sub_row)
             
             if 'steps' in sub and sub['steps']:
                 for step in sub['steps']:
-                    step_row = {
-                        'id': next_id,
-                        'parent_id': subtask_id,
-                        'text': step,
-                        'level': 2,
-                        'completed': False,
-                        'currentEmotion': '',
-                        'completionEmotion': '',
-                        'totalTimeEstimate': '',
-                        'createdAt': created_at,
-                        'startTime': '',
-                        'endTime': '',
-                        'timeSpent': '',
-                        'username': username
-                    }
+                    step_row = Task(
+                        next_id,
+                        parent_id=subtask_id,
+                        text=step,
+                        level=2,
+                        createdAt=created_at,
+                        username=username
+                    )
                     rows.append(step_row)
                     next_id += 1
     return rows
 
-# User authentication functions
-def load_users_from_csv():
-    users = {}
-    if not os.path.exists(USERS_FILE):
-        print(f"Creating new users file at {USERS_FILE}")
-        with open(USERS_FILE, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=['username', 'password', 'api_key'])
-            writer.writeheader()
-        return users
-    
-    try:
-        print(f"Loading users from {USERS_FILE}")
-        with open(USERS_FILE, 'r', newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            print(f"CSV Headers: {reader.fieldnames}")
-            for row in reader:
-                print(f"Processing user row: {row}")
-                users[row.get('username', '')] = {
-                    'password': row.get('password', ''),
-                    'api_key': row.get('api_key', '')
-                }
-        print(f"Loaded {len(users)} users: {list(users.keys())}")
-    except Exception as e:
-        print(f"Error loading users: {e}")
-        # If there's an error with the CSV file, recreate it
-        print("Recreating users.csv file with correct headers")
-        with open(USERS_FILE, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=['username', 'password', 'api_key'])
-            writer.writeheader()
-    return users
-
-def add_user_to_csv(username, password):
-    users = load_users_from_csv()
-    if username in users:
-        return False
-    
-    with open(USERS_FILE, 'a', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=['username', 'password', 'api_key'])
-        writer.writerow({'username': username, 'password': password, 'api_key': ''})
-    return True
-
-def update_user_api_key(username, api_key):
-    users = load_users_from_csv()
-    if username not in users:
-        return False
-    
-    # Read all rows
-    rows = []
-    with open(USERS_FILE, 'r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        fieldnames = reader.fieldnames
-        for row in reader:
-            if row['username'] == username:
-                row['api_key'] = api_key
-            rows.append(row)
-    
-    # Write back all rows
-    with open(USERS_FILE, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(rows)
-    return True
-
 def get_user_api_key(username):
-    users = load_users_from_csv()
-    return users.get(username, {}).get('api_key', '')
+    return users.api_key(username)
 
 # Login required decorator
 def login_required(f):
@@ -247,14 +204,50 @@ def login_required(f):
 # 2) Flask App Setup        #
 #############################
 
-# Initialize Hugging Face client if token exists
-hf_token = os.getenv("HUGGINGFACE_API_TOKEN")
-hf_client = None
-if hf_token:
-    hf_client = InferenceClient(token=hf_token)
+def create_app(warm=False):
+    """The app, for gunicorn 'app:create_app()'.
+
+    Safe to call before forking (gunicorn --preload): storage and the
+    writer thread are only set up on each worker's first request. warm=True
+    also imports the model client now, so preloaded workers share it.
+    """
+    if warm:
+        warm_up()
+    return app
+
+@app.before_request
+def ensure_runtime():
+    if task_writer is None:
+        init_runtime()
 
-# A global in-memory list that we load at startup:
-task_list = load_tasks_from_csv()
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    """Point url_for('static', filename=...) at the file's fingerprinted copy."""
+    if endpoint == 'static' and assets is not None:
+        values['filename'] = assets.url(values.get('filename')) or values.get('filename')
+
+def serve_static(filename):
+    """Fingerprinted files come precompressed from memory and are cached for good.
+
+    Anything else, like an old unfingerprinted URL, goes to Flask's handler.
+    """
+    asset = assets.get(filename) if assets is not None else None
+    if asset is None:
+        return app.send_static_file(filename)
+    encoding = asset.encoding_for(request.accept_encodings)
+    # Any encoding's tag will do; the content behind them is the same
+    if any(request.if_none_match.contains(etag) for etag in asset.etags()):
+        response = Response(status=304)
+    else:
+        response = Response(asset.bodies[encoding], mimetype=asset.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(asset.etag_for(encoding))
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
+
+app.view_functions['static'] = serve_static
 
 @app.route('/')
 def index():
@@ -274,10 +267,7 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        users = load_users_from_csv()
-        #print(f"Loaded users: {users}")
-        
-        if username in users and users[username]['password'] == password:
+        if users.check_password(username, password):
             #print(f"Login successful for {username}")
             session['username'] = username
             return redirect(url_for('index'))
@@ -302,7 +292,7 @@ def signup():
         if password != confirm_password:
             error = 'Passwords do not match. Please try again.'
         else:
-            if add_user_to_csv(username, password):
+            if users.add(username, password):
                 # Set a success message for login page
                 return redirect(url_for('login', success='Account created successfully! Please login.'))
             else:
@@ -316,47 +306,152 @@ def logout():
     session.pop('username', None)
     return redirect(url_for('login'))
 
+def run_generation(username, context, progress=None):
+    """Generation job body: ask the model, then store the new tree for username.
+
+    The title and subtasks are reported to progress as the model writes them.
+    """
+    ai_result = generate_ai_result(context, get_user_api_key(username), progress)
+    store_generated_tree(username, ai_result)
+    return ai_result
+
+def store_generated_tree(username, ai_result):
+    # ai_result example:
+    # {
+    #   "taskTitle": "Something",
+    #   "subTasks": [
+    #       {"title": "Subtask 1", "steps": ["Step 1.1", "Step 1.2"]}
+    #   ]
+    # }
+
+    with task_lock:
+        # Convert ai_result to CSV rows with username
+        refresh_tasks()
+        new_rows = convert_ai_result_to_csv_rows(ai_result, username)
+        
+        # Add the new tree to our global task_store
+        for row in new_rows:
+            task_store.add(row)
+        
+        # Save the new tree
+        waiter = persist_tasks(new_rows)
+    task_writer.wait(waiter)
+
+generation_jobs = JobQueue(run_generation)
+# /generate bodies only carry a context to decompose; bigger ones get a 413
+MAX_GENERATE_BODY = int(os.getenv('MAX_GENERATE_BODY', str(64 * 1024)))
+
 @app.route('/generate', methods=['POST'])
 @login_required
 def generate_tasks():
-    """Generate tasks using AI based on user input"""
+    """Queue a task generation job and return its id straight away"""
+    if (request.content_length or 0) > MAX_GENERATE_BODY:
+        return jsonify({"error": "Request too large"}), 413
     user_input = request.json.get('context', '')
     
     if not user_input:
         return jsonify({"error": "Empty input"}), 400
     
     try:
-        # If we have a Hugging Face client, use it
-        if hf_client:
-            ai_result = generate_tasks_with_huggingface(user_input)
-        else:
-            # Fallback to mock data for testing
-            ai_result = generate_mock_tasks(user_input)
-        
-        # ai_result example:
-        # {
-        #   "taskTitle": "Something",
-        #   "subTasks": [
-        #       {"title": "Subtask 1", "steps": ["Step 1.1", "Step 1.2"]}
-        #   ]
-        # }
+        # A double-submit of the same context joins the job that's already running
+        job = generation_jobs.submit(session['username'], user_input, key=normalize_context(user_input))
+    except JobRejected as e:
+        return jsonify({"error": str(e)}), e.status
+    return jsonify(job_status(job)), 202
 
-        # Convert ai_result to CSV rows with username
-        new_rows = convert_ai_result_to_csv_rows(ai_result, session['username'])
-        
-        # Extend our global task_list
-        global task_list
-        task_list.extend(new_rows)
-        
-        # Save to CSV
-        write_tasks_to_csv(task_list)
-        
-        # Return the same structure we had before on the front end
-        return jsonify(ai_result)
+@app.route('/generate/stream', methods=['POST'])
+@login_required
+def generate_tasks_stream():
+    """Generate tasks, streaming the title and each subtask as server-sent events.
+
+    Runs as a generation job like /generate, so the same limits apply and a
+    double-submit follows the job that's already running. Sends 'title' and
+    'subtask' events while the model writes, then 'done' with the whole
+    tree once it has been saved, or 'error'.
+    """
+    if (request.content_length or 0) > MAX_GENERATE_BODY:
+        return jsonify({"error": "Request too large"}), 413
+    user_input = request.json.get('context', '')
     
-    except Exception as e:
-        print(f"Error generating tasks: {e}")
-        return jsonify({"error": str(e)}), 500
+    if not user_input:
+        return jsonify({"error": "Empty input"}), 400
+    
+    try:
+        job = generation_jobs.submit(session['username'], user_input, key=normalize_context(user_input))
+    except JobRejected as e:
+        return jsonify({"error": str(e)}), e.status
+    
+    def stream():
+        seen = 0
+        while True:
+            seen, status, message = generation_stream_message(job, seen)
+            # Keeps proxies from closing the connection while the job is queued
+            yield message or ": keep-alive\n\n"
+            if status in ('done', 'error'):
+                return
+            generation_jobs.wait(job['id'], status, timeout=15, seen=seen)
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def generation_stream_message(job, seen):
+    """The /generate/stream events for what the job did after its first seen progress events.
+
+    Returns the new seen count, the status the events go up to and the events' text.
+    """
+    # Status first: progress is complete by the time a job is done
+    status = job['status']
+    events = job['progress'][seen:]
+    parts = [f"event: {event}\ndata: {json.dumps(data)}\n\n" for event, data in events]
+    if status == 'done':
+        parts.append(f"event: done\ndata: {json.dumps(job['result'])}\n\n")
+    elif status == 'error':
+        parts.append(f"event: error\ndata: {json.dumps({'error': job['error']})}\n\n")
+    return seen + len(events), status, ''.join(parts)
+
+@app.route('/generate/cache', methods=['GET'])
+@login_required
+def generation_cache_stats():
+    """Hit/miss counters for the model result cache, plus coalesced duplicate calls"""
+    stats = decomposition_cache.stats()
+    stats['coalesced'] = model_calls.shared
+    return jsonify(stats)
+
+def job_status(job):
+    return {key: job[key] for key in ('id', 'status', 'result', 'error')}
+
+@app.route('/generate/<job_id>', methods=['GET'])
+@login_required
+def get_generation_job(job_id):
+    """Poll a generation job. 'result' is the AI task tree once status is 'done'."""
+    job = generation_jobs.get(job_id, session['username'])
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_status(job))
+
+@app.route('/generate/<job_id>/events', methods=['GET'])
+@login_required
+def generation_job_events(job_id):
+    """Server-sent events for a generation job: one 'status' event per state change."""
+    job = generation_jobs.get(job_id, session['username'])
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    def stream():
+        status = None
+        current = job
+        while True:
+            if current['status'] != status:
+                status = current['status']
+                yield f"event: status\ndata: {json.dumps(job_status(current))}\n\n"
+                if status in ('done', 'error'):
+                    return
+            else:
+                # Keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+            current = generation_jobs.wait(job_id, status, timeout=15) or current
+    
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 @app.route('/api-key', methods=['GET', 'POST'])
 @login_required
@@ -372,172 +467,311 @@ def manage_api_key():
         if not api_key:
             return jsonify({'success': False, 'error': 'API key cannot be empty'})
         
-        if update_user_api_key(session['username'], api_key):
+        if users.update_api_key(session['username'], api_key):
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': 'Failed to update API key'})
 
-def generate_tasks_with_huggingface(context):
-    """Generate tasks using Hugging Face API"""
-    prompt = f"""You are an AI task decomposition assistant. Your job is to help users break down complex tasks into manageable sub-tasks and steps.
-
-I need to break down this task into a structured format:
-
-{context}
-
-Please provide:
-1. A clear main task title
-2. A list of sub-tasks with estimated time
-3. For each sub-task, provide concrete actionable steps
-4. Suggest current emotions I might be feeling about this task
-5. Suggest emotions I might feel upon completion
-
-emotion_dict = (
-    "Anger": ["Aggressive", "Frustrated", "Distant", "Critical", "Hateful", "Resentful"],
-    "Disgust": ["Disapproval", "Disappointed", "Awful", "Avoidance", "Guilty"],
-    "Sad": ["Guilty", "Abandoned", "Despair", "Depressed", "Bored"],
-    "Happy": ["Optimistic", "Proud", "Joyful", "Interested", "Accepted"],
-    "Surprise": ["Startled", "Confused", "Amazed", "Excited"],
-    "Fear": ["Scared", "Anxious", "Insecure", "Rejected", "Helpless"],
-). 
-
-Format your response as a JSON object with the following structure:
-{{
-  "taskTitle": "Main task title",
-  "totalTimeEstimate": "Total estimated time (e.g., '2 hours')",
-  "currentEmotion": ["emotion1", "emotion2"],
-  "completionEmotion": ["emotion1", "emotion2"],
-  "subTasks": [
-    {{
-      "title": "Sub-task 1",
-      "totalTimeEstimate": "Estimated time (e.g., '30 minutes')",
-      "steps": [
-        "Step 1 description",
-        "Step 2 description"
-      ]
-    }}
-  ]
-}}"""
-
-    try:
-        # Get user's API key
-        user_api_key = get_user_api_key(session['username'])
-        
-        # If user has no API key, use the default one from .env
-        if not user_api_key:
-            user_api_key = os.getenv("HUGGINGFACE_API_TOKEN")
-            if not user_api_key:
-                return generate_mock_tasks(context)
-        
-        # Initialize client with user's API key
-        client = InferenceClient(token=user_api_key)
-        
-        try:
-            # Use Mistral model
-            model_id = "mistralai/Mistral-7B-Instruct-v0.2"
-            response = client.text_generation(
-                prompt,
-                model=model_id,
-                max_new_tokens=1024,
-                temperature=0.7,
-                return_full_text=False
-            )
-            result = response.strip()
-            
-            # Clean up the response to extract just the JSON part
-            if "{" in result and "}" in result:
-                json_start = result.find("{")
-                json_end = result.rfind("}") + 1
-                json_str = result[json_start:json_end]
-                
-                # Parse JSON
-                try:
-                    task_data = json.loads(json_str)
-                    return task_data
-                except json.JSONDecodeError as e:
-                    print(f"JSON decode error: {e}")
-                    return generate_mock_tasks(context)
-            else:
-                print("No valid JSON found in response")
-                return generate_mock_tasks(context)
-                
-        except Exception as e:
-            print(f"Error with Mistral model: {str(e)}")
-            # If user's API key fails, try the default one
-            if user_api_key != os.getenv("HUGGINGFACE_API_TOKEN"):
-                print("Falling back to default API key")
-                return generate_tasks_with_huggingface(context)
-            return generate_mock_tasks(context)
-            
-    except Exception as e:
-        print(f"Error generating tasks with Hugging Face: {e}")
-        return generate_mock_tasks(context)
-
-def generate_mock_tasks(context):
-    """Generate mock tasks for testing"""
-    # Create a simple task structure based on the context
-    words = context.split()
-    main_task = " ".join(words[:min(5, len(words))]) + " Task"
-    
-    return {
-        "taskTitle": main_task,
-        "subTasks": [
-            {
-                "title": f"Plan {main_task}",
-                "steps": ["Research requirements", "Define scope", "Set timeline"]
-            },
-            {
-                "title": f"Execute {main_task}",
-                "steps": ["Complete first part", "Review progress", "Finish remaining items"]
-            },
-            {
-                "title": f"Review {main_task}",
-                "steps": ["Check for errors", "Get feedback", "Make final adjustments"]
-            }
-        ]
-    }
-
 @app.route('/tasks', methods=['GET'])
 @login_required
 def get_all_tasks():
-    """Return all tasks from CSV so the front end can display them."""
+    """Return the current user's tasks so the front end can display them.
+
+    Responses carry the user's version as ETag, so a matching If-None-Match
+    gets a 304; see tasks_etag. With ?since=<version> only the tasks changed and ids deleted
+    after that version are returned, as {"version", "full", "tasks", "deleted"};
+    "full" is true when since is too old and "tasks" is the whole list.
+    """
     try:
-        # Only load tasks for the current user
-        tasks = load_tasks_from_csv(session.get('username'))
-        return jsonify(tasks)
+        # Served from memory; the files are only re-read if another worker wrote them
+        refresh_tasks()
+        username = session.get('username')
+        version = task_store.user_version(username)
+        etag = tasks_etag(username, version)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            since = request.args.get('since', type=int)
+            if since is None:
+                response = jsonify(tasks_json(task_store.user_tasks(username)))
+            else:
+                response = jsonify(tasks_since(username, since))
+        response.set_etag(etag)
+        response.headers['X-Tasks-Version'] = str(version)
+        # Let the browser keep a copy but always revalidate it
+        response.cache_control.no_cache = True
+        return response
     except Exception as e:
         print(f"Error loading tasks: {e}")
         return jsonify({"error": str(e)}), 500
 
+def tasks_etag(username, version):
+    """The /tasks ETag: the version, behind a hash of the username.
+
+    Users with no changes share the same starting version, so the version
+    alone would let one user's cached list match another's.
+    """
+    user_hash = hashlib.sha256(username.encode('utf-8')).hexdigest()[:16]
+    return f"{user_hash}-{version}"
+
+def tasks_since(username, since):
+    changes = task_store.changes_since(username, since)
+    if changes is None:
+        return {'version': task_store.user_version(username), 'full': True,
+                'tasks': tasks_json(task_store.user_tasks(username)), 'deleted': []}
+    version, changed, deleted = changes
+    return {'version': version, 'full': False, 'tasks': tasks_json(changed), 'deleted': deleted}
+
+def tasks_json(tasks):
+    return [task.to_json() for task in tasks]
+
+# Each /tasks/events response ends after this long and the browser reconnects,
+# so a client that went away without closing can't hold a thread for good
+EVENT_STREAM_SECONDS = int(os.getenv('EVENT_STREAM_SECONDS', '300'))
+
+@app.route('/tasks/events', methods=['GET'])
+@login_required
+def task_events():
+    """Server-sent events with the user's task changes, from any tab or worker.
+
+    'change' events carry {"version", "tasks", "deleted"}: each changed task
+    in full and the ids deleted. The stream starts with 'hello' and the
+    current version, so the client can catch up with /tasks?since= on
+    anything it missed before connecting; 'resync' means changes were lost
+    and it should do the same. Reconnecting with Last-Event-ID resumes from
+    that event if it's still remembered.
+    """
+    username = session['username']
+    start, hello = open_task_events(username, request.headers.get('Last-Event-ID', ''))
+    
+    def stream():
+        if hello:
+            yield hello
+        cursor = start
+        deadline = time.monotonic() + EVENT_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            cursor, message = task_event_message(cursor, change_bus.wait(username, cursor, timeout=15))
+            yield message
+    
+    response = Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(change_bus.unsubscribe)
+    return response
+
+def open_task_events(username, last_event_id):
+    """Subscribe a new /tasks/events stream: (bus position to start after, hello message or '')."""
+    refresh_tasks()
+    bus = change_bus
+    token, _, last_seq = last_event_id.partition('-')
+    # Before the response starts, so the broker is already relaying by then
+    bus.subscribe()
+    if token == bus.token and last_seq.isdigit():
+        return int(last_seq), ''
+    start = bus.position()
+    version = task_store.user_version(username)
+    return start, f"id: {bus.token}-{start}\nevent: hello\ndata: {json.dumps({'version': version})}\n\n"
+
+def task_event_message(cursor, events):
+    """(new cursor, SSE text) for what change_bus.wait() returned."""
+    bus = change_bus
+    if events is None:
+        cursor = bus.position()
+        return cursor, f"id: {bus.token}-{cursor}\nevent: resync\ndata: {{}}\n\n"
+    if events:
+        return events[-1][0], ''.join(f"id: {bus.token}-{seq}\nevent: change\ndata: {json.dumps(event)}\n\n"
+                                      for seq, event in events)
+    # Keeps proxies from closing an idle connection
+    return cursor, ": keep-alive\n\n"
+
+MAX_SEARCH_RESULTS = 100
+
+@app.route('/tasks/search', methods=['GET'])
+@login_required
+def search_tasks():
+    """Search the user's tasks by text.
+
+    ?q= words that must all appear in the task, plus optional level=,
+    completed=true|false, emotion= and limit= filters. Results are best
+    first, each with its chain of parent tasks from the root down.
+    """
+    query = request.args.get('q', '').strip()
+    emotion = request.args.get('emotion', '').strip()
+    if not query and not emotion:
+        return jsonify({"error": "q or emotion is required"}), 400
+    completed = request.args.get('completed')
+    if completed is not None:
+        completed = completed.lower() in ('true', '1', 'yes')
+    limit = min(request.args.get('limit', 20, type=int), MAX_SEARCH_RESULTS)
+    
+    refresh_tasks()
+    hits = task_store.search(session['username'], query, level=request.args.get('level', type=int),
+                             completed=completed, emotion=emotion or None, limit=limit)
+    return jsonify({
+        "query": query,
+        "results": [{
+            "task": task.to_json(),
+            "score": round(score, 4),
+            "ancestors": [{"id": a.id, "text": a.text, "level": a.level} for a in ancestors]
+        } for task, score, ancestors in hits]
+    })
+
+@app.route('/stats', methods=['GET'])
+@login_required
+def task_stats():
+    """Progress and time spent, rolled up per tree and for the whole user.
+
+    Includes histograms of the user's current and completion emotion tags.
+    With ?tree=<id>, returns that task's rollup and one per direct child.
+    """
+    refresh_tasks()
+    username = session['username']
+    tree_id = request.args.get('tree', type=int)
+    stats = task_store.stats(username, tree_id)
+    if stats is None:
+        return jsonify({"error": "Task not found"}), 404
+    if tree_id is not None:
+        task, totals = stats['task']
+        return jsonify(dict(rollup_json(task, totals), children=[
+            rollup_json(child, child_totals) for child, child_totals in stats['children']
+        ]))
+    return jsonify(dict(rollup_json(None, stats['totals']), emotions=stats['emotions'], trees=[
+        rollup_json(root, totals) for root, totals in stats['trees']
+    ]))
+
+def rollup_json(task, totals):
+    count, completed, seconds = totals
+    body = {} if task is None else {'id': task.id, 'text': task.text, 'level': task.level}
+    body.update({
+        'tasks': count,
+        'completed': completed,
+        'progress': round(completed / count, 4) if count else 0.0,
+        'seconds': seconds,
+        'timeSpent': format_duration(seconds),
+    })
+    return body
+
+#############################
+# 3) Task Operations        #
+#############################
+
+# Each operation changes task_store in memory only and returns
+# (response body, status code, changed tasks, deleted ids). run_task_ops
+# applies a list of them under task_lock and persists everything at once.
+
+def toggle_op(username, task_id, data):
+    """Toggle completion on a specific task."""
+    # Find the task and toggle its completion
+    target_task = task_store.get(username, task_id)
+    changed = []
+    
+    if target_task:
+        target_task.completed = not target_task.completed
+        changed.append(target_task)
+        # If the task is now marked as complete and it's a subtask (level 1),
+        # mark all its child tasks (micro tasks, level 2) as complete too
+        if target_task.completed and target_task.level == 1:
+            for child_task in task_store.children(username, task_id):
+                child_task.completed = True
+                changed.append(child_task)
+    
+    return {"success": True}, 200, changed, set()
+
+def update_op(username, task_id, data):
+    """Update a task's text, emotion, or time estimate."""
+    task = task_store.get(username, task_id)
+    if not task:
+        return {"error": "Task not found"}, 404, [], set()
+    
+    # Update fields if they exist in the request
+    fields = {}
+    if 'text' in data:
+        if not isinstance(data['text'], str):
+            return {"error": "text must be a string"}, 400, [], set()
+        fields['text'] = data['text']
+    if 'currentEmotion' in data:
+        fields['currentEmotion'] = intern_text(data['currentEmotion'])
+    if 'completionEmotion' in data:
+        fields['completionEmotion'] = intern_text(data['completionEmotion'])
+    if 'totalTimeEstimate' in data:
+        fields['totalTimeEstimate'] = intern_text(data['totalTimeEstimate'])
+    task_store.edit(task, **fields)
+    
+    return {"success": True}, 200, [task], set()
+
+def delete_op(username, task_id, data):
+    """Delete a task and all its sub-tasks recursively."""
+    deletion_ids = task_store.remove_tree(username, task_id)
+    return {"success": True}, 200, [], deletion_ids
+
+def stopwatch_op(username, task_id, data):
+    """Start, stop, or reset the stopwatch for a task"""
+    action = data.get('action', '')
+    now = int(time.time())
+    
+    found = None
+    task = task_store.get(username, task_id)
+    if task:
+        if action == 'start':
+            task.startTime = now
+            task.endTime = None
+            found = task
+        elif action == 'stop':
+            if task.startTime is not None:  # Can only stop if there's a start time
+                task.endTime = now
+                # Add to existing time spent
+                task.timeSpent = (task.timeSpent or 0) + (task.endTime - task.startTime)
+                found = task
+        elif action == 'reset':
+            task.startTime = None
+            task.endTime = None
+            task.timeSpent = None
+            found = task
+    
+    if not found:
+        return {"error": "Task not found or invalid action"}, 404, [], set()
+    
+    return {"success": True}, 200, [found], set()
+
+TASK_OPS = {
+    'toggle': toggle_op,
+    'update': update_op,
+    'delete': delete_op,
+    'stopwatch': stopwatch_op,
+}
+
+def run_task_ops(username, operations):
+    """Apply (op name, task id, data) operations in order with a single storage write.
+
+    Returns a (response body, status code) pair per operation.
+    """
+    results = []
+    changed = {}
+    deleted = set()
+    with task_lock:
+        # Pick up changes written by other workers
+        refresh_tasks()
+        for name, task_id, data in operations:
+            body, status, changed_tasks, deleted_ids = TASK_OPS[name](username, task_id, data)
+            for task in changed_tasks:
+                changed[task.id] = task
+            deleted |= deleted_ids
+            results.append((body, status))
+        # A task changed and then deleted in the same batch only needs the delete
+        saved = [t for t in changed.values() if task_store.get(username, t.id) is t]
+        waiter = persist_changes(saved, [(username, deleted)] if deleted else [])
+    task_writer.wait(waiter)
+    return results
+
+def run_task_op(name, task_id, data=None):
+    (body, status), = run_task_ops(session.get('username'), [(name, task_id, data or {})])
+    return jsonify(body), status
+
 @app.route('/tasks/<int:task_id>/toggle', methods=['POST'])
 @login_required
 def toggle_task_completion(task_id):
     """Toggle completion on a specific task."""
     try:
-        global task_list
-        # Reload tasks to get the latest data
-        task_list = load_tasks_from_csv()
-        
-        # Find the task and toggle its completion
-        target_task = None
-        for task in task_list:
-            if task['id'] == task_id and task['username'] == session.get('username'):
-                task['completed'] = not task['completed']
-                target_task = task
-                break
-        
-        if target_task:
-            # If the task is now marked as complete and it's a subtask (level 1),
-            # mark all its child tasks (micro tasks, level 2) as complete too
-            if target_task['completed'] and target_task['level'] == 1:
-                for child_task in task_list:
-                    if child_task['parent_id'] == target_task['id'] and child_task['username'] == session.get('username'):
-                        child_task['completed'] = True
-        
-        # Save changes back to CSV
-        write_tasks_to_csv(task_list)
-        
-        return jsonify({"success": True})
+        return run_task_op('toggle', task_id)
     except Exception as e:
         print(f"Error toggling task: {e}")
         return jsonify({"error": str(e)}), 500
@@ -546,101 +780,289 @@ def toggle_task_completion(task_id):
 @login_required
 def update_task(task_id):
     """Update a task's text, emotion, or time estimate."""
-    global task_list
-    data = request.json
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    found = False
-    for task in task_list:
-        if task['id'] == task_id and task['username'] == session.get('username'):
-            # Update fields if they exist in the request
-            if 'text' in data:
-                task['text'] = data['text']
-            if 'currentEmotion' in data:
-                task['currentEmotion'] = data['currentEmotion']
-            if 'completionEmotion' in data:
-                task['completionEmotion'] = data['completionEmotion']
-            if 'totalTimeEstimate' in data:
-                task['totalTimeEstimate'] = data['totalTimeEstimate']
-            found = True
-            break
-    
-    if not found:
-        return jsonify({"error": "Task not found"}), 404
-    
-    write_tasks_to_csv(task_list)
-    return jsonify({"success": True})
+    return run_task_op('update', task_id, request.json)
 
 @app.route('/tasks/<int:task_id>', methods=['DELETE'])
 @login_required
 def delete_task(task_id):
     """Delete a task and all its sub-tasks recursively."""
-    global task_list
-    
-    deletion_ids = set()
-    def gather_children(tid):
-        deletion_ids.add(tid)
-        for t in task_list:
-            if t['parent_id'] == tid and t['username'] == session.get('username'):
-                gather_children(t['id'])
-    gather_children(task_id)
-    
-    # Filter out the deleted tasks
-    task_list = [t for t in task_list if t['id'] not in deletion_ids or t['username'] != session.get('username')]
-    write_tasks_to_csv(task_list)
-    return jsonify({"success": True})
+    return run_task_op('delete', task_id)
 
 @app.route('/tasks/<int:task_id>/stopwatch', methods=['POST'])
 @login_required
 def update_task_timer(task_id):
     """Start, stop, or reset the stopwatch for a task"""
-    global task_list
-    action = request.json.get('action', '')
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return run_task_op('stopwatch', task_id, request.json)
+
+@app.route('/tasks/batch', methods=['POST'])
+@login_required
+def batch_update_tasks():
+    """Apply several task operations in one request and one write.
+
+    Body: {"operations": [{"op": "toggle" | "update" | "stopwatch" | "delete",
+    "id": <task id>, ...the fields that op's own route takes}, ...]}.
+    Operations run in order, and nothing else touches the tasks in between.
+    Each gets its own entry in "results" with the body and status its single
+    route would have returned.
+    """
+    operations = (request.json or {}).get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations must be a non-empty list"}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({"error": f"At most {MAX_BATCH_OPERATIONS} operations per batch"}), 400
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in TASK_OPS or type(operation.get('id')) is not int:
+            return jsonify({"error": f"Invalid operation: {operation}"}), 400
     
-    found = False
-    for task in task_list:
-        if task['id'] == task_id and task['username'] == session.get('username'):
-            if action == 'start':
-                task['startTime'] = now
-                task['endTime'] = ''
-                found = True
-            elif action == 'stop':
-                if task['startTime']:  # Can only stop if there's a start time
-                    task['endTime'] = now
-                    
-                    # Calculate time spent
-                    if task['startTime'] and task['endTime']:
-                        start = datetime.strptime(task['startTime'], "%Y-%m-%d %H:%M:%S")
-                        end = datetime.strptime(task['endTime'], "%Y-%m-%d %H:%M:%S")
-                        seconds_diff = int((end - start).total_seconds())
-                        
-                        # Add to existing time spent
-                        existing_seconds = 0
-                        if task['timeSpent']:
-                            parts = task['timeSpent'].split(':')
-                            if len(parts) == 3:
-                                existing_seconds = int(parts[0]) * 3600 + int(parts[1]) * 60 + int(parts[2])
-                        
-                        total_seconds = existing_seconds + seconds_diff
-                        hours = total_seconds // 3600
-                        minutes = (total_seconds % 3600) // 60
-                        seconds = total_seconds % 60
-                        
-                        task['timeSpent'] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                    found = True
-            elif action == 'reset':
-                task['startTime'] = ''
-                task['endTime'] = ''
-                task['timeSpent'] = ''
-                found = True
+    results = run_task_ops(session.get('username'), [(o['op'], o['id'], o) for o in operations])
+    return jsonify({
+        "success": all(status == 200 for _, status in results),
+        "results": [dict(body, status=status) for body, status in results],
+    })
+
+# Rows per chunk written by /tasks/export and per commit in /tasks/import
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '500'))
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '500'))
+# Old id -> new id for the most recent tasks of an import; children whose
+# parent has dropped out of it are imported as new trees
+IMPORT_ID_MAP_SIZE = int(os.getenv('IMPORT_ID_MAP_SIZE', '100000'))
+
+def transfer_format(default='ndjson'):
+    """'csv' or 'ndjson', from ?format= or else the request's Content-Type."""
+    fmt = request.args.get('format', '').lower()
+    if not fmt:
+        fmt = 'csv' if request.mimetype == 'text/csv' else default
+    return fmt if fmt in ('csv', 'ndjson') else None
+
+@app.route('/tasks/export', methods=['GET'])
+@login_required
+def export_tasks():
+    """Stream all of the user's tasks as NDJSON (default) or CSV (?format=csv).
+
+    Each tree comes out parent first, so the file can be sent straight back
+    to /tasks/import. Rows are formatted a chunk at a time as they're sent.
+    """
+    fmt = transfer_format()
+    if fmt is None:
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+    refresh_tasks()
+    username = session['username']
+    # Only references to the tasks; their text is formatted as it's sent
+    tasks = task_store.tree_order(username)
+    if fmt == 'csv':
+        body, mimetype = export_csv(tasks), 'text/csv'
+    else:
+        body, mimetype = export_ndjson(tasks), 'application/x-ndjson'
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="tasks-{username}.{fmt}"'
+    response.headers['X-Tasks-Version'] = str(task_store.user_version(username))
+    return response
+
+def export_ndjson(tasks):
+    for start in range(0, len(tasks), EXPORT_CHUNK_SIZE):
+        yield ''.join(json.dumps(task.to_json()) + '\n' for task in tasks[start:start + EXPORT_CHUNK_SIZE])
+
+def export_csv(tasks):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(TASK_FIELDS)
+    for start in range(0, len(tasks), EXPORT_CHUNK_SIZE):
+        writer.writerows(task.to_row() for task in tasks[start:start + EXPORT_CHUNK_SIZE])
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    if out.tell():
+        yield out.getvalue()
+
+@app.route('/tasks/import', methods=['POST'])
+@login_required
+def import_tasks():
+    """Add tasks from an NDJSON or CSV upload, like the files /tasks/export writes.
+
+    The body is the file itself, or a multipart form with a "file" field.
+    Imported tasks get fresh ids; parent links are remapped to match. A task
+    whose parent isn't earlier in the file becomes a new top-level task.
+    Rows are read and committed IMPORT_BATCH_SIZE at a time, so a large
+    file is never held in memory whole.
+    """
+    fmt = transfer_format()
+    if fmt is None:
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    if upload is not None and not request.args.get('format') and upload.filename.lower().endswith('.csv'):
+        fmt = 'csv'
+    lines = upload_lines(upload.stream if upload is not None else request.stream)
+
+    username = session['username']
+    counts = {'imported': 0, 'batches': 0, 'orphaned': 0, 'rejected': 0}
+    id_map = OrderedDict()
+    batch = []
+    try:
+        for task in read_import_rows(lines, fmt, counts):
+            batch.append(task)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                import_batch(username, batch, id_map, counts)
+                batch = []
+        if batch:
+            import_batch(username, batch, id_map, counts)
+    except (UnicodeDecodeError, csv.Error) as e:
+        print(f"Error importing tasks: {e}")
+        return jsonify(dict(counts, error=f"Unreadable {fmt} upload: {e}")), 400
+    except Exception as e:
+        # Batches already counted are saved; the one that failed left nothing behind
+        print(f"Error importing tasks: {e}")
+        return jsonify(dict(counts, error=str(e))), 500
+    return jsonify(counts)
+
+def upload_lines(stream, size=65536):
+    """Decoded lines from a binary stream, read size bytes at a time."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    rest = ''
+    while True:
+        chunk = stream.read(size)
+        rest += decoder.decode(chunk, final=not chunk)
+        *lines, rest = rest.split('\n')
+        for line in lines:
+            yield line + '\n'
+        if not chunk:
             break
-    
-    if not found:
-        return jsonify({"error": "Task not found or invalid action"}), 404
-    
-    write_tasks_to_csv(task_list)
-    return jsonify({"success": True})
+    if rest:
+        yield rest
+
+def read_import_rows(lines, fmt, counts):
+    """Tasks from the uploaded lines; rows that can't be read or stored are counted as rejected."""
+    if fmt == 'csv':
+        rows = csv.DictReader(lines)
+        parse = Task.from_row
+    else:
+        rows = (line for line in lines if line.strip())
+        parse = lambda line: Task.from_json(json.loads(line))
+    for row in rows:
+        try:
+            task = parse(row)
+            task_store.check(task)
+        except Exception:
+            counts['rejected'] += 1
+            continue
+        yield task
+
+def import_batch(username, batch, id_map, counts):
+    """Give a batch of imported tasks fresh ids and commit it as one write.
+
+    The whole batch is renumbered before any of it goes into task_store,
+    and id_map only learns its ids once it's in, so a failure leaves
+    neither half-updated.
+    """
+    with task_lock:
+        refresh_tasks()
+        next_id = allocate_task_ids(username, len(batch))
+        new_ids = OrderedDict()
+        orphaned = 0
+        for task in batch:
+            old_id, task.id = task.id, next_id
+            next_id += 1
+            task.username = intern_text(username)
+            if task.parent_id:
+                parent_id = new_ids.get(task.parent_id)
+                if parent_id is None:
+                    parent_id = id_map.get(task.parent_id)
+                    if parent_id is not None:
+                        id_map.move_to_end(task.parent_id)
+                if parent_id is None:
+                    orphaned += 1
+                    task.parent_id, task.level = 0, 0
+                else:
+                    task.parent_id = parent_id
+            if old_id:
+                new_ids[old_id] = task.id
+        task_store.add_all(batch)
+        waiter = persist_tasks(batch)
+    task_writer.wait(waiter)
+    for old_id, new_id in new_ids.items():
+        id_map[old_id] = new_id
+        if len(id_map) > IMPORT_ID_MAP_SIZE:
+            id_map.popitem(last=False)
+    # Let the writer catch up before reading more, so the queue stays one batch deep
+    task_writer.flush()
+    counts['imported'] += len(batch)
+    counts['orphaned'] += orphaned
+    counts['batches'] += 1
+
+#############################
+# 4) Metrics                #
+#############################
+
+# Set METRICS_TOKEN to require "Authorization: Bearer <token>" on /metrics
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+request_seconds = Histogram('http_request_duration_seconds', 'Time to handle a request, up to the first byte',
+                            ('method', 'route'))
+requests_total = Counter('http_requests_total', 'Requests handled', ('method', 'route', 'status'))
+Callback('tasks_in_memory', 'Tasks held in memory', lambda: len(task_store))
+Callback('users_in_memory', 'Users held in memory', lambda: len(users))
+Callback('storage_write_batches_total', 'Batches written by the task writer',
+         lambda: task_writer.flushes, kind='counter')
+Callback('storage_write_records_total', 'Task records written by the task writer',
+         lambda: task_writer.records_written, kind='counter')
+Callback('task_event_subscribers', 'Open /tasks/events streams in this process',
+         lambda: change_bus.subscribers)
+Callback('task_events_total', 'Task change events delivered in this process',
+         lambda: change_bus.published, kind='counter')
+profiler = RequestProfiler()
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.collect_spans()
+    g.profile = profiler.start() if profiler.wanted(request.headers) else None
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_seconds.observe(elapsed, request.method, route)
+    requests_total.inc(request.method, route, str(response.status_code))
+    # Where the time went, e.g. storage_load;dur=80.1, next to the total
+    timings = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in metrics.finish_spans().items()]
+    timings.append(f"total;dur={elapsed * 1000:.1f}")
+    response.headers['Server-Timing'] = ', '.join(timings)
+    return response
+
+@app.teardown_request
+def stop_request_profile(error=None):
+    # Runs even when the view raised, so the profiler is always handed back
+    metrics.finish_spans()
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.stop(profile, f"{request.method} {request.path}")
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Counters, gauges and latency histograms in the Prometheus text format"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.cli.command('migrate-sqlite')
+def migrate_sqlite_command():
+    """Copy tasks.csv and users.csv into the SQLite database."""
+    migrate_csv_to_sqlite()
+
+@app.cli.command('shard-tasks')
+def shard_tasks_command():
+    """Split tasks.csv into one file per user (for TASK_LAYOUT=sharded)."""
+    split_tasks_into_shards()
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Write the fingerprinted, compressed copies of static/ ahead of deploying."""
+    manifest = build_assets(app.static_folder)
+    if manifest is not None:
+        for filename, name in sorted(manifest.urls.items()):
+            print(f"{filename} -> {name}")
 
 if __name__ == '__main__':
     app.run(debug=True, port=8083)
\ No newline at end of file
@@ -0,0 +1,376 @@
+"""Async serving mode: uvicorn asgi:app --port 8083
+
+Serves the same app as app.py, but the requests that spend their time
+waiting are coroutines on one event loop rather than threads: the
+/tasks/events, /generate/<id>/events and /generate/stream streams, and
+the model calls behind /generate and /generate/stream. Every other route is the usual Flask view, run on a pool
+of ASGI_THREADS threads so storage I/O never blocks the loop. A single
+worker can then hold thousands of open streams and pending generations.
+"""
+import asyncio
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import session
+
+import app as todo
+from generation import generate_ai_result_async
+from generation_cache import normalize_context
+from jobs import JobRejected
+
+# Threads for the Flask views and anything else that blocks
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', '32'))
+# Waiting generations only cost a coroutine here, so many more can queue
+ASYNC_MAX_PENDING_JOBS = int(os.getenv('ASYNC_MAX_PENDING_JOBS', '1000'))
+# Request bodies are read before the view runs; bigger ones go to a temp file
+MAX_MEMORY_BODY = 1024 * 1024
+JOB_EVENTS_PATH = re.compile(r'/generate/([^/]+)/events')
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+
+class Waiters:
+    """asyncio.Events by key (a username or job id) that any thread can set."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._events = {}
+
+    def add(self, key):
+        event = asyncio.Event()
+        self._events.setdefault(key, set()).add(event)
+        return event
+
+    def remove(self, key, event):
+        events = self._events.get(key)
+        if events is not None:
+            events.discard(event)
+            if not events:
+                del self._events[key]
+
+    def notify(self, key):
+        self.loop.call_soon_threadsafe(self._wake, key)
+
+    def _wake(self, key):
+        for event in self._events.get(key, ()):
+            event.set()
+
+
+class TodoAsgi:
+    def __init__(self, flask_app, threads=ASGI_THREADS):
+        self.flask_app = flask_app
+        self.threads = threads
+        self.loop = None
+        self.user_waiters = None
+        self.job_waiters = None
+        self._started = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        await self.start()
+        if scope['method'] == 'GET':
+            if scope['path'] == '/tasks/events':
+                return await self.task_events(scope, receive, send)
+            match = JOB_EVENTS_PATH.fullmatch(scope['path'])
+            if match:
+                return await self.job_events(scope, receive, send, match.group(1))
+        elif scope['method'] == 'POST' and scope['path'] == '/generate/stream':
+            return await self.generate_stream(scope, receive, send)
+        await self.wsgi(scope, receive, send)
+
+    async def start(self):
+        """Set up the runtime and hook it to this loop, on the first request or at startup."""
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._start())
+        await self._started
+
+    async def _start(self):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(self.threads, thread_name_prefix='asgi'))
+        await loop.run_in_executor(None, todo.init_runtime)
+        self.user_waiters = Waiters(loop)
+        self.job_waiters = Waiters(loop)
+        todo.change_bus.add_listener(self.user_waiters.notify)
+        todo.generation_jobs.add_listener(lambda job: self.job_waiters.notify(job['id']))
+        todo.generation_jobs.run_on(loop, run_generation_async, ASYNC_MAX_PENDING_JOBS)
+        self.loop = loop
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if todo.task_writer is not None:
+                    await in_thread(todo.task_writer.flush)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def wsgi(self, scope, receive, send):
+        """Run the Flask view on the thread pool, streaming its response back."""
+        body = tempfile.SpooledTemporaryFile(MAX_MEMORY_BODY)
+        try:
+            more = True
+            while more:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                more = message.get('more_body', False)
+            body.seek(0)
+            loop = self.loop
+
+            def send_sync(message):
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+            await loop.run_in_executor(None, run_wsgi, self.flask_app, wsgi_environ(scope, body), send_sync)
+        finally:
+            body.close()
+
+    def session_user(self, scope):
+        with self.flask_app.request_context(wsgi_environ(scope, None)):
+            return session.get('username')
+
+    async def task_events(self, scope, receive, send):
+        """The /tasks/events stream of app.py, waiting on the loop instead of a thread."""
+        username = self.session_user(scope)
+        if username is None:
+            return await send_redirect(send, '/login')
+        last_event_id = header(scope, b'last-event-id')
+        start, hello = await in_thread(todo.open_task_events, username, last_event_id)
+        todo.requests_total.inc('GET', '/tasks/events', '200')
+        bus = todo.change_bus
+        waiter = self.user_waiters.add(username)
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive, waiter))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+            if hello:
+                await send_text(send, hello)
+            cursor = start
+            deadline = time.monotonic() + todo.EVENT_STREAM_SECONDS
+            while not disconnected.done() and time.monotonic() < deadline:
+                # timeout=0 only looks; the bus listener sets waiter when there's more
+                waiter.clear()
+                events = bus.wait(username, cursor, timeout=0)
+                if events == []:
+                    await wait_or_timeout(waiter, 15)
+                    if disconnected.done():
+                        break
+                    events = bus.wait(username, cursor, timeout=0)
+                cursor, message = todo.task_event_message(cursor, events)
+                await send_text(send, message)
+            await send({'type': 'http.response.body', 'body': b''})
+        except OSError:
+            pass
+        finally:
+            disconnected.cancel()
+            self.user_waiters.remove(username, waiter)
+            bus.unsubscribe()
+
+    async def job_events(self, scope, receive, send, job_id):
+        """The /generate/<job_id>/events stream of app.py, waiting on the loop."""
+        username = self.session_user(scope)
+        if username is None:
+            return await send_redirect(send, '/login')
+        job = todo.generation_jobs.get(job_id, username)
+        if job is None:
+            todo.requests_total.inc('GET', '/generate/<job_id>/events', '404')
+            return await send_json(send, 404, {"error": "Job not found"})
+        todo.requests_total.inc('GET', '/generate/<job_id>/events', '200')
+        waiter = self.job_waiters.add(job_id)
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive, waiter))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+            status = None
+            while not disconnected.done():
+                waiter.clear()
+                current = todo.generation_jobs.get(job_id) or job
+                if current['status'] != status:
+                    status = current['status']
+                    await send_text(send, f"event: status\ndata: {json.dumps(todo.job_status(current))}\n\n")
+                    if status in ('done', 'error'):
+                        break
+                else:
+                    # Keeps proxies from closing an idle connection
+                    await send_text(send, ": keep-alive\n\n")
+                await wait_or_timeout(waiter, 15)
+            await send({'type': 'http.response.body', 'body': b''})
+        except OSError:
+            pass
+        finally:
+            disconnected.cancel()
+            self.job_waiters.remove(job_id, waiter)
+
+    async def generate_stream(self, scope, receive, send):
+        """The /generate/stream route of app.py, following its job on the loop."""
+        username = self.session_user(scope)
+        if username is None:
+            return await send_redirect(send, '/login')
+        body = b''
+        more = True
+        while more:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if len(body) > todo.MAX_GENERATE_BODY:
+                todo.requests_total.inc('POST', '/generate/stream', '413')
+                return await send_json(send, 413, {"error": "Request too large"})
+            more = message.get('more_body', False)
+        try:
+            user_input = (json.loads(body or b'{}') or {}).get('context', '')
+        except (ValueError, AttributeError):
+            user_input = None
+        if not user_input:
+            todo.requests_total.inc('POST', '/generate/stream', '400')
+            return await send_json(send, 400, {"error": "Empty input"})
+        try:
+            job = todo.generation_jobs.submit(username, user_input, key=normalize_context(user_input))
+        except JobRejected as e:
+            todo.requests_total.inc('POST', '/generate/stream', str(e.status))
+            return await send_json(send, e.status, {"error": str(e)})
+        todo.requests_total.inc('POST', '/generate/stream', '200')
+        waiter = self.job_waiters.add(job['id'])
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive, waiter))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+            seen = 0
+            while not disconnected.done():
+                waiter.clear()
+                seen, status, message = todo.generation_stream_message(job, seen)
+                await send_text(send, message or ": keep-alive\n\n")
+                if status in ('done', 'error'):
+                    break
+                await wait_or_timeout(waiter, 15)
+            await send({'type': 'http.response.body', 'body': b''})
+        except OSError:
+            pass
+        finally:
+            disconnected.cancel()
+            self.job_waiters.remove(job['id'], waiter)
+
+
+async def run_generation_async(username, context, progress=None):
+    """app.run_generation as a coroutine: the model call is awaited, the rest runs on threads."""
+    api_key = await in_thread(todo.get_user_api_key, username)
+    ai_result = await generate_ai_result_async(context, api_key, progress)
+    await in_thread(todo.store_generated_tree, username, ai_result)
+    return ai_result
+
+def in_thread(fn, *args):
+    """Run a blocking call on the thread pool."""
+    return asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+def run_wsgi(wsgi_app, environ, send):
+    """Call a WSGI app on this thread and pass its response to send(ASGI message)."""
+    response = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and response and response[0] is None:
+            raise exc_info[1].with_traceback(exc_info[2])
+        response[:] = [{
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        }]
+
+    result = wsgi_app(environ, start_response)
+    try:
+        for chunk in result:
+            # Headers go with the first chunk, so a view can still change them until then
+            if response[0] is not None:
+                send(response[0])
+                response[0] = None
+            if chunk:
+                send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if response[0] is not None:
+            send(response[0])
+        send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+def wsgi_environ(scope, body):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body if body is not None else tempfile.SpooledTemporaryFile(0),
+        # The whole body has been read already, however it was sent
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'] = server[0]
+    environ['SERVER_PORT'] = str(server[1] or 80)
+    client = scope.get('client')
+    if client:
+        environ['REMOTE_ADDR'] = client[0]
+        environ['REMOTE_PORT'] = str(client[1])
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+async def wait_for_disconnect(receive, waiter):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    waiter.set()
+
+async def wait_or_timeout(event, timeout):
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+async def send_text(send, text):
+    await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+async def send_json(send, status, body):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps(body).encode('utf-8')})
+
+async def send_redirect(send, location):
+    await send({'type': 'http.response.start', 'status': 302,
+                'headers': [(b'location', location.encode('latin-1')), (b'content-length', b'0')]})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+app = TodoAsgi(todo.create_app())
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, port=8083)
@@ -0,0 +1,215 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import tempfile
+
+try:
+    import brotli
+except ImportError:  # pip install brotli for .br copies; gzip is always built
+    brotli = None
+
+# 'off' serves static/ as-is, e.g. while editing the CSS and JS
+ASSET_PIPELINE = os.getenv('ASSET_PIPELINE', 'on')
+# Where the fingerprinted, minified and compressed copies are written
+ASSET_BUILD_DIR = os.getenv('ASSET_BUILD_DIR', 'build/static')
+# A fingerprinted URL always has the same content, so browsers can keep it for good
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json', '.txt')
+# Below this the compressed copy is rarely smaller than the headers it costs
+MIN_COMPRESS_SIZE = 256
+
+CSS_TOKEN_RE = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|/\*.*?\*/|\s+|[^"\'/\s]+|/', re.S)
+
+
+def minify_css(text):
+    """Drops comments and the whitespace CSS doesn't need; strings are left alone."""
+    out = []
+    space = False
+    for token in CSS_TOKEN_RE.findall(text):
+        if token.startswith('/*'):
+            continue
+        if token.isspace():
+            space = True
+            continue
+        if token[0] not in '"\'':
+            token = token.replace(';}', '}')
+            if token[0] == '}' and out and out[-1].endswith(';'):
+                out[-1] = out[-1][:-1]
+                if not out[-1]:
+                    out.pop()
+        if space and out and out[-1][-1] not in '{};:,>(' and token[0] not in '{};,>!)':
+            out.append(' ')
+        space = False
+        out.append(token)
+    return ''.join(out)
+
+def minify_js(text):
+    """Strips indentation, blank lines and whole-line // comments.
+
+    Line breaks are kept, so automatic semicolon insertion reads the code
+    the same way, and lines inside a multi-line template literal are copied
+    as they are.
+    """
+    lines = []
+    quote = None
+    for line in text.splitlines():
+        if quote == '`':
+            lines.append(line)
+        else:
+            code = line.lstrip()
+            if not code or code.startswith('//'):
+                continue
+            lines.append(code)
+        quote = open_quote(line, quote)
+        if quote != '`':
+            lines[-1] = lines[-1].rstrip()
+    return '\n'.join(lines) + '\n'
+
+def open_quote(line, quote):
+    """The template literal quote still open at the end of line, or None."""
+    i = 0
+    while i < len(line):
+        char = line[i]
+        if char == '\\':
+            i += 2
+            continue
+        if quote is None:
+            if line.startswith('//', i):
+                break
+            if char in '\'"`':
+                quote = char
+        elif char == quote:
+            quote = None
+        i += 1
+    # Only template literals run on to the next line
+    return '`' if quote == '`' else None
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+class Asset:
+    """One built file: its fingerprinted name and the bytes of each encoding."""
+
+    def __init__(self, name, digest, bodies):
+        self.name = name
+        self.etag = digest
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        # encoding ('br', 'gzip' or 'identity') -> bytes
+        self.bodies = bodies
+
+    def etag_for(self, encoding):
+        return self.etag if encoding == 'identity' else f"{self.etag}-{encoding}"
+
+    def etags(self):
+        return [self.etag_for(encoding) for encoding in self.bodies]
+
+    def encoding_for(self, accept_encoding):
+        """The smallest encoding the client accepts."""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.bodies and accept_encoding[encoding]:
+                return encoding
+        return 'identity'
+
+
+class AssetManifest:
+    """Fingerprinted copies of the files under static/.
+
+    build() minifies each CSS and JS file, names the result after its hash
+    (css/style.css -> css/style.<hash>.css) and writes it, with .gz and .br
+    copies, to ASSET_BUILD_DIR, along with manifest.json mapping the
+    original names to the built ones. Files already built are only read back,
+    so each worker builds at startup in the time it takes to hash static/.
+    The built files are kept in memory and served from there.
+    """
+
+    def __init__(self, static_dir, build_dir=ASSET_BUILD_DIR):
+        self.static_dir = static_dir
+        self.build_dir = build_dir
+        self.urls = {}  # original name -> fingerprinted name
+        self.assets = {}  # fingerprinted name -> Asset
+
+    def build(self):
+        for filename in self._sources():
+            name, asset = self._build_file(filename)
+            self.urls[filename] = name
+            self.assets[name] = asset
+        write_file(os.path.join(self.build_dir, 'manifest.json'),
+                   json.dumps(self.urls, indent=2, sort_keys=True).encode('utf-8'))
+        return self
+
+    def url(self, filename):
+        return self.urls.get(filename)
+
+    def get(self, name):
+        return self.assets.get(name)
+
+    def _sources(self):
+        build_dir = os.path.abspath(self.build_dir)
+        for root, dirs, files in os.walk(self.static_dir):
+            dirs[:] = sorted(d for d in dirs
+                             if not d.startswith('.') and os.path.abspath(os.path.join(root, d)) != build_dir)
+            for file in sorted(files):
+                # .DS_Store and the like
+                if not file.startswith('.'):
+                    path = os.path.relpath(os.path.join(root, file), self.static_dir)
+                    yield path.replace(os.sep, '/')
+
+    def _build_file(self, filename):
+        with open(os.path.join(self.static_dir, filename), 'rb') as f:
+            data = f.read()
+        base, ext = os.path.splitext(filename)
+        minify = MINIFIERS.get(ext.lower())
+        if minify is not None:
+            data = minify(data.decode('utf-8')).encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        name = f"{base}.{digest}{ext}"
+        bodies = {'identity': data}
+        path = os.path.join(self.build_dir, name)
+        if not os.path.exists(path):
+            write_file(path, data)
+        if ext.lower() in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE:
+            compressors = [('gzip', '.gz', lambda raw: gzip.compress(raw, 9, mtime=0))]
+            if brotli is not None:
+                compressors.append(('br', '.br', lambda raw: brotli.compress(raw, quality=11)))
+            for encoding, suffix, compress in compressors:
+                body = read_file(path + suffix)
+                if body is None:
+                    body = compress(data)
+                    write_file(path + suffix, body)
+                if len(body) < len(data):
+                    bodies[encoding] = body
+        return name, Asset(name, digest, bodies)
+
+
+def read_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def write_file(path, data):
+    """Write via a temp file and rename, so workers building at once never see half a file."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def build_assets(static_dir):
+    """The manifest for static_dir, or None with ASSET_PIPELINE=off or if the build fails."""
+    if ASSET_PIPELINE == 'off':
+        return None
+    try:
+        return AssetManifest(static_dir).build()
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Error building static assets, serving static/ as-is: {e}")
+        return None
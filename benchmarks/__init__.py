@@ -0,0 +1 @@
+"""Load tests for the Flask routes and the storage layer. Run with python -m benchmarks."""
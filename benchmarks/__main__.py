@@ -0,0 +1,156 @@
+"""Seed synthetic data, load the app and measure it.
+
+    python -m benchmarks --users 100 --tasks 100000 --requests 5000 --threads 8
+
+Runs against a throwaway copy of the data in a temporary directory, with
+the stub model, so nothing in the working tree is touched and no API key
+is needed. See python -m benchmarks --help for the options.
+"""
+import argparse
+import importlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--tasks', type=int, default=10000, help='rows to seed, 1k to 1M')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--driver', choices=['client', 'http', 'asgi', 'both', 'all'], default='both',
+                        help='Flask test client, the threaded HTTP server, the ASGI server (asgi.py on '
+                             'uvicorn), both (client and http) or all three')
+    parser.add_argument('--streams', type=int, default=0,
+                        help='/tasks/events connections to hold open during the http and asgi runs')
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default='csv')
+    parser.add_argument('--layout', choices=['single', 'sharded'], default='single')
+    parser.add_argument('--model-delay', type=float, default=0.0,
+                        help='seconds the stub model takes per generation')
+    parser.add_argument('--trace', help='replay a JSON-lines trace, e.g. requests.jsonl, instead of the synthetic mix')
+    parser.add_argument('--baseline', help='compare against this results file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown against the baseline before exiting non-zero')
+    parser.add_argument('--save-baseline', help='write the results here')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    for name in ('trace', 'baseline', 'save_baseline'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    # storage and generation read these at import time, so set them before importing the app
+    os.environ['STORAGE_BACKEND'] = args.backend
+    os.environ['TASK_LAYOUT'] = args.layout
+    os.environ['TASK_MODEL'] = 'stub'
+    os.environ['STUB_MODEL_DELAY'] = str(args.model_delay)
+    sys.path.insert(0, ROOT)
+    workdir = tempfile.mkdtemp(prefix='todo-bench-')
+    os.chdir(workdir)
+
+    from benchmarks import load, report
+    from benchmarks.seed import seed
+
+    start = time.perf_counter()
+    ids = seed(workdir, args.users, args.tasks, args.seed)
+    seed_seconds = time.perf_counter() - start
+    print(f"Seeded {sum(len(v) for v in ids.values())} tasks for {args.users} users "
+          f"in {seed_seconds:.2f}s ({workdir})")
+
+    start = time.perf_counter()
+    app_module = importlib.import_module('app')
+    app = app_module.app
+    startup_seconds = time.perf_counter() - start
+    print(f"App loaded in {startup_seconds:.2f}s")
+
+    if args.trace:
+        plan = load.trace_plan(args.trace, list(ids), args.seed)
+    else:
+        plan = load.synthetic_plan(ids, args.requests, seed=args.seed)
+
+    results = {
+        'params': {key: value for key, value in vars(args).items()
+                   if key not in ('baseline', 'save_baseline')},
+        'seed_seconds': round(seed_seconds, 3),
+        'startup_seconds': round(startup_seconds, 3),
+        'drivers': {},
+    }
+    # asgi goes last: once it has run, generation jobs expect its event loop
+    drivers = {'both': ['client', 'http'], 'all': ['client', 'http', 'asgi']}.get(args.driver, [args.driver])
+    for driver in drivers:
+        recorder = load.Recorder()
+        streams = None
+        if driver == 'client':
+            elapsed = load.run(plan, args.threads, lambda user: load.ClientSession(app, user), recorder)
+        else:
+            server = start_server(app) if driver == 'http' else start_asgi_server()
+            base_url = f"http://127.0.0.1:{server.server_port}"
+            try:
+                if args.streams:
+                    streams = load.StreamHolder(base_url, list(ids), args.streams)
+                    print(f"{driver}: {streams.opened} event streams open in {streams.open_seconds:.2f}s"
+                          f" ({streams.failed} failed)")
+                elapsed = load.run(plan, args.threads, lambda user: load.HttpSession(base_url, user), recorder)
+            finally:
+                if streams:
+                    streams.close()
+                server.shutdown()
+        app_module.task_writer.flush()
+        summary = results['drivers'][driver] = report.summarize(recorder, elapsed)
+        if streams:
+            summary['streams'] = {'opened': streams.opened, 'failed': streams.failed,
+                                  'open_seconds': round(streams.open_seconds, 3)}
+        report.print_summary(driver, summary)
+
+    report.print_server_comparison(results)
+    results['peak_rss_mb'] = report.peak_rss_mb()
+    print(f"\nPeak RSS: {results['peak_rss_mb']} MB")
+
+    status = 0
+    if args.baseline:
+        if report.compare(results, report.load_baseline(args.baseline), args.tolerance):
+            status = 1
+    if args.save_baseline:
+        report.save_baseline(args.save_baseline, results)
+    return status
+
+def start_server(app):
+    from werkzeug.serving import make_server
+    # One access log line per request would cost more than some of the routes
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return server
+
+class AsgiServer:
+    """uvicorn serving asgi.py on a background thread, stopped like make_server's servers."""
+
+    def __init__(self):
+        import uvicorn
+        import asgi
+        self.server = uvicorn.Server(uvicorn.Config(asgi.app, host='127.0.0.1', port=0, log_level='error',
+                                                    backlog=4096))
+        self.thread = threading.Thread(target=self.server.run, name='bench-asgi', daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        self.server_port = self.server.servers[0].sockets[0].getsockname()[1]
+
+    def shutdown(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
+
+def start_asgi_server():
+    return AsgiServer()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
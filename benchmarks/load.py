@@ -0,0 +1,242 @@
+import asyncio
+import json
+import queue
+import random
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from benchmarks.seed import PASSWORD
+
+# Share of requests per route in a synthetic run
+DEFAULT_MIX = {
+    'list': 50,
+    'toggle': 15,
+    'update': 10,
+    'stopwatch': 15,
+    'delete': 5,
+    'generate': 5,
+}
+GENERATE_TIMEOUT = 60
+STREAM_OPEN_TIMEOUT = 60
+# Connections being opened at once by StreamHolder
+STREAM_OPEN_CONCURRENCY = 100
+
+
+class Recorder:
+    """Latency samples and failures (5xx, or exceptions) per route label, shared by all worker threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, label, seconds, ok):
+        with self._lock:
+            self.samples.setdefault(label, []).append(seconds)
+            if not ok:
+                self.errors[label] = self.errors.get(label, 0) + 1
+
+
+class ClientSession:
+    """One logged-in user on the Flask test client."""
+
+    def __init__(self, app, username):
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['username'] = username
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpSession:
+    """One logged-in user talking HTTP to a running server."""
+
+    def __init__(self, base_url, username):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.post(f"{base_url}/login", data={'username': username, 'password': PASSWORD},
+                          allow_redirects=False)
+
+    def request(self, method, path, body=None):
+        response = self.session.request(method, self.base_url + path, json=body)
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        return response.status_code, data
+
+
+def synthetic_plan(ids, count, mix=DEFAULT_MIX, seed=0):
+    """count (username, label, method, path, body) requests drawn from mix."""
+    rng = random.Random(seed)
+    usernames = [name for name in ids if ids[name]] or list(ids)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    plan = []
+    for i in range(count):
+        username = rng.choice(usernames)
+        kind = rng.choices(kinds, weights)[0]
+        task_id = rng.choice(ids[username]) if ids[username] else 0
+        if kind == 'list':
+            plan.append((username, 'GET /tasks', 'GET', '/tasks', None))
+        elif kind == 'toggle':
+            plan.append((username, 'POST /tasks/<id>/toggle', 'POST', f"/tasks/{task_id}/toggle", None))
+        elif kind == 'update':
+            plan.append((username, 'POST /tasks/<id>/update', 'POST', f"/tasks/{task_id}/update",
+                         {'text': f"Edited {i}"}))
+        elif kind == 'stopwatch':
+            action = rng.choice(['start', 'stop', 'reset'])
+            plan.append((username, 'POST /tasks/<id>/stopwatch', 'POST', f"/tasks/{task_id}/stopwatch",
+                         {'action': action}))
+        elif kind == 'delete':
+            plan.append((username, 'DELETE /tasks/<id>', 'DELETE', f"/tasks/{task_id}", None))
+        elif kind == 'generate':
+            plan.append((username, 'POST /generate', 'POST', '/generate',
+                         {'context': f"Plan synthetic project number {i}"}))
+    return plan
+
+def trace_plan(path, usernames, seed=0):
+    """Requests replayed from a JSON-lines trace.
+
+    Lines with "method" and "path" (and optionally "body" and "user") are
+    sent as they are. Any other line, such as an entry of the backlog in
+    requests.jsonl, is turned into a POST /generate with its title and
+    body as the context.
+    """
+    rng = random.Random(seed)
+    plan = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            username = entry.get('user') or rng.choice(usernames)
+            if 'method' in entry and 'path' in entry:
+                method = entry['method'].upper()
+                label = f"{method} " + re.sub(r'/\d+', '/<id>', entry['path'].split('?')[0])
+                plan.append((username, label, method, entry['path'], entry.get('body')))
+            else:
+                context = ' '.join(str(entry.get(key, '')) for key in ('title', 'body')).strip()
+                plan.append((username, 'POST /generate', 'POST', '/generate', {'context': context}))
+    return plan
+
+def run(plan, threads, make_session, recorder):
+    """Send the plan from `threads` workers. Returns the wall time in seconds."""
+    work = queue.Queue()
+    for item in plan:
+        work.put(item)
+
+    def worker():
+        sessions = {}
+        while True:
+            try:
+                username, label, method, path, body = work.get_nowait()
+            except queue.Empty:
+                return
+            session = sessions.get(username)
+            if session is None:
+                session = sessions[username] = make_session(username)
+            start = time.perf_counter()
+            try:
+                if path == '/generate':
+                    ok = generate(session, body)
+                else:
+                    status, _ = session.request(method, path, body)
+                    # A 404 for a task deleted earlier in the run is still a served request
+                    ok = status < 500
+            except Exception as e:
+                print(f"Error sending {label}: {e}")
+                ok = False
+            recorder.record(label, time.perf_counter() - start, ok)
+
+    workers = [threading.Thread(target=worker, name=f"bench-{i}") for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - start
+
+def generate(session, body):
+    """Queue a generation and wait for the job, so the sample covers the whole tree."""
+    status, job = session.request('POST', '/generate', body)
+    if status != 202:
+        return False
+    deadline = time.monotonic() + GENERATE_TIMEOUT
+    while time.monotonic() < deadline:
+        status, job = session.request('GET', f"/generate/{job['id']}")
+        if status != 200:
+            return False
+        if job['status'] in ('done', 'error'):
+            return job['status'] == 'done'
+        time.sleep(0.01)
+    return False
+
+
+class StreamHolder:
+    """Idle /tasks/events connections held open while the load runs.
+
+    They're spread over the users and all live on one asyncio thread here,
+    so the client side stays cheap whatever the count; what they cost the
+    server is what's being measured. opened, failed and open_seconds say
+    how it went.
+    """
+
+    def __init__(self, base_url, usernames, count):
+        url = urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port
+        self.count = count
+        self.opened = 0
+        self.failed = 0
+        self.open_seconds = 0.0
+        self._cookies = [HttpSession(base_url, name).session.cookies.get('session') for name in usernames[:count]]
+        self._ready = threading.Event()
+        self._loop = None
+        self._stop = None
+        self._thread = threading.Thread(target=self._run, name='bench-streams', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(timeout=30)
+
+    def _run(self):
+        asyncio.run(self._hold())
+
+    async def _hold(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        limit = asyncio.Semaphore(STREAM_OPEN_CONCURRENCY)
+        start = time.perf_counter()
+        opened = await asyncio.gather(*(self._open(i, limit) for i in range(self.count)))
+        self.open_seconds = time.perf_counter() - start
+        writers = [writer for writer in opened if writer is not None]
+        self.opened = len(writers)
+        self.failed = self.count - self.opened
+        self._ready.set()
+        await self._stop.wait()
+        for writer in writers:
+            writer.close()
+
+    async def _open(self, i, limit):
+        async with limit:
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                        STREAM_OPEN_TIMEOUT)
+                cookie = self._cookies[i % len(self._cookies)]
+                writer.write((f"GET /tasks/events HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                              f"Cookie: session={cookie}\r\nAccept: text/event-stream\r\n\r\n").encode())
+                # Open once the server has said hello
+                await asyncio.wait_for(reader.readuntil(b'event: hello'), STREAM_OPEN_TIMEOUT)
+                return writer
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                print(f"Error opening event stream {i}: {e}")
+                return None
@@ -0,0 +1,106 @@
+import json
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def summarize(recorder, elapsed):
+    routes = {}
+    total = 0
+    for label, samples in sorted(recorder.samples.items()):
+        samples = sorted(samples)
+        total += len(samples)
+        routes[label] = {
+            'count': len(samples),
+            'errors': recorder.errors.get(label, 0),
+            'p50_ms': round(percentile(samples, 50) * 1000, 3),
+            'p95_ms': round(percentile(samples, 95) * 1000, 3),
+            'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        }
+    return {
+        'requests': total,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(total / elapsed, 1) if elapsed else 0.0,
+        'routes': routes,
+    }
+
+def print_summary(name, summary):
+    print(f"\n{name}: {summary['requests']} requests in {summary['seconds']}s, "
+          f"{summary['throughput_rps']} req/s")
+    print(f"  {'route':<32} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for label, route in summary['routes'].items():
+        print(f"  {label:<32} {route['count']:>7} {route['errors']:>7} "
+              f"{route['p50_ms']:>9} {route['p95_ms']:>9} {route['p99_ms']:>9}")
+
+def print_server_comparison(results, first='http', second='asgi'):
+    """Side by side p95s and throughput of two drivers from the same run."""
+    drivers = results['drivers']
+    if first not in drivers or second not in drivers:
+        return
+    a, b = drivers[first], drivers[second]
+    print(f"\n{first} vs {second}:")
+    print(f"  {'throughput req/s':<32} {a['throughput_rps']:>9} {b['throughput_rps']:>9}")
+    for label, route in a['routes'].items():
+        other = b['routes'].get(label)
+        if other is not None:
+            print(f"  {label + ' p95 ms':<32} {route['p95_ms']:>9} {other['p95_ms']:>9}")
+    if 'streams' in a and 'streams' in b:
+        print(f"  {'event streams opened':<32} {a['streams']['opened']:>9} {b['streams']['opened']:>9}")
+        print(f"  {'seconds to open them':<32} {a['streams']['open_seconds']:>9} {b['streams']['open_seconds']:>9}")
+
+def compare(results, baseline, tolerance):
+    """Print the change against a stored baseline. Returns the regressions found.
+
+    A regression is a p95 or throughput that is more than tolerance (a
+    fraction) worse than the baseline's.
+    """
+    regressions = []
+    print(f"\nCompared with baseline (tolerance {tolerance:.0%}):")
+    for driver, summary in results['drivers'].items():
+        old = baseline.get('drivers', {}).get(driver)
+        if old is None:
+            continue
+        change = relative(summary['throughput_rps'], old['throughput_rps'])
+        print(f"  {driver} throughput {old['throughput_rps']} -> {summary['throughput_rps']} req/s ({change:+.1%})")
+        if change < -tolerance:
+            regressions.append(f"{driver} throughput")
+        for label, route in summary['routes'].items():
+            old_route = old['routes'].get(label)
+            if old_route is None:
+                continue
+            change = relative(route['p95_ms'], old_route['p95_ms'])
+            print(f"  {driver} {label} p95 {old_route['p95_ms']} -> {route['p95_ms']} ms ({change:+.1%})")
+            if change > tolerance:
+                regressions.append(f"{driver} {label} p95")
+    if regressions:
+        print("Regressions: " + ', '.join(regressions))
+    return regressions
+
+def relative(new, old):
+    return (new - old) / old if old else 0.0
+
+def load_baseline(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_baseline(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved baseline to {path}")
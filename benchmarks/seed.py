@@ -0,0 +1,72 @@
+import csv
+import json
+import os
+import random
+import time
+
+from task_model import TASK_FIELDS, Task
+
+PASSWORD = 'bench'
+# Same shape as generate_mock_tasks: a title, 3 subtasks with 3 steps each
+SUBTASKS = 3
+STEPS = 3
+TREE_SIZE = 1 + SUBTASKS * (1 + STEPS)
+
+EMOTIONS = ['Happy', 'Anxious', 'Calm', 'Excited', 'Tired', 'Focused', 'Stressed', 'Proud']
+ESTIMATES = ['15 minutes', '30 minutes', '1 hour', '2 hours', '1 day']
+
+
+def seed(directory, users, tasks, seed=0):
+    """Write users.csv and tasks.csv with about `tasks` rows spread over `users` users.
+
+    Every user has the password PASSWORD. Returns {username: [task ids]} so
+    the load generator can aim at tasks that exist.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    usernames = [f"bench{i}" for i in range(users)]
+    with open(os.path.join(directory, 'users.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['username', 'password', 'api_key'])
+        writer.writerows([name, PASSWORD, ''] for name in usernames)
+
+    ids = {name: [] for name in usernames}
+    now = int(time.time())
+    next_id = 1
+    with open(os.path.join(directory, 'tasks.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(TASK_FIELDS)
+        for tree in range(max(1, tasks // TREE_SIZE)):
+            username = usernames[tree % users]
+            created_at = now - rng.randrange(30 * 24 * 3600)
+            for task in make_tree(next_id, username, created_at, rng):
+                writer.writerow(task.to_row())
+                ids[username].append(task.id)
+            next_id += TREE_SIZE
+    return ids
+
+def make_tree(first_id, username, created_at, rng):
+    root = Task(
+        first_id,
+        text=f"Synthetic task {first_id}",
+        currentEmotion=json.dumps(rng.sample(EMOTIONS, 2)),
+        completionEmotion=json.dumps(rng.sample(EMOTIONS, 1)),
+        totalTimeEstimate=rng.choice(ESTIMATES),
+        createdAt=created_at,
+        username=username,
+    )
+    yield root
+    next_id = first_id + 1
+    for s in range(SUBTASKS):
+        sub = Task(next_id, parent_id=first_id, text=f"Subtask {s + 1} of {first_id}", level=1,
+                   completed=rng.random() < 0.3, totalTimeEstimate=rng.choice(ESTIMATES),
+                   createdAt=created_at, username=username)
+        if rng.random() < 0.2:
+            sub.timeSpent = rng.randrange(7200)
+        yield sub
+        next_id += 1
+        for step in range(STEPS):
+            yield Task(next_id, parent_id=sub.id, text=f"Step {step + 1}", level=2,
+                       completed=sub.completed or rng.random() < 0.3, createdAt=created_at,
+                       username=username)
+            next_id += 1
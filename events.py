@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+# Changes kept per user so a reconnecting client can pick up where it left off
+EVENT_BACKLOG = int(os.getenv('EVENT_BACKLOG', '256'))
+# SQLite file the worker processes pass changes through; 'off' for a single process
+EVENT_BROKER = os.getenv('EVENT_BROKER', 'events.db')
+EVENT_POLL_MS = float(os.getenv('EVENT_POLL_MS', '100'))
+# Broker rows older than this are deleted
+EVENT_RETENTION_SECONDS = int(os.getenv('EVENT_RETENTION_SECONDS', '300'))
+
+
+class ChangeBus:
+    """Per-user feed of task changes for the /tasks/events stream.
+
+    Events are small dicts ({"version", "tasks", "deleted"}) numbered from
+    one sequence per process. Each user's latest EVENT_BACKLOG are kept, so
+    a subscriber that fell behind or reconnected gets what it missed, or is
+    told to resync if that has already been dropped. With a broker, events
+    published here also reach the buses of the other worker processes.
+    """
+
+    def __init__(self, broker=None, backlog=EVENT_BACKLOG):
+        self.broker = broker
+        self.backlog = backlog
+        # Tells this process's event ids apart from another worker's
+        self.token = uuid.uuid4().hex[:8]
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._events = {}  # username -> deque of (seq, event)
+        self._dropped = {}  # username -> seq of the newest event pushed out of the backlog
+        self.subscribers = 0
+        self.published = 0
+        self._listeners = []
+        if broker is not None:
+            broker.start(self)
+
+    def publish(self, username, event):
+        self.deliver(username, event)
+        if self.broker is not None:
+            self.broker.publish(username, event)
+
+    def deliver(self, username, event):
+        """Add an event to this process's feed only."""
+        with self._cond:
+            self._seq += 1
+            events = self._events.get(username)
+            if events is None:
+                events = self._events[username] = deque()
+            events.append((self._seq, event))
+            if len(events) > self.backlog:
+                self._dropped[username] = events.popleft()[0]
+            self.published += 1
+            self._cond.notify_all()
+        for listener in self._listeners:
+            listener(username)
+
+    def add_listener(self, fn):
+        """Also call fn(username) for each event, from the thread that delivers it."""
+        self._listeners.append(fn)
+
+    def position(self):
+        with self._cond:
+            return self._seq
+
+    def wait(self, username, after, timeout):
+        """(seq, event) pairs for the user newer than after, waiting up to timeout for one.
+
+        Returns None if some of them have already been dropped.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._newest(username) > after, timeout)
+            if after < self._dropped.get(username, 0):
+                return None
+            return [(seq, event) for seq, event in self._events.get(username, ()) if seq > after]
+
+    def subscribe(self):
+        with self._cond:
+            self.subscribers += 1
+
+    def unsubscribe(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def _newest(self, username):
+        events = self._events.get(username)
+        return events[-1][0] if events else 0
+
+
+class SqliteBroker:
+    """Passes events between worker processes through a shared SQLite table.
+
+    publish() only queues; one thread per process writes the queue every
+    EVENT_POLL_MS and, while this process has subscribers, reads the rows
+    the other processes wrote since it last looked. Events that fail to be
+    written are dropped; other workers' clients see those changes the next
+    time they load /tasks.
+    """
+
+    def __init__(self, path, poll_ms=EVENT_POLL_MS, retention=EVENT_RETENTION_SECONDS):
+        self.path = path
+        self.interval = poll_ms / 1000.0
+        self.retention = retention
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._outbox = []
+        self._lock = threading.Lock()
+        self._bus = None
+
+    def start(self, bus):
+        self._bus = bus
+        threading.Thread(target=self._run, name='event-broker', daemon=True).start()
+
+    def publish(self, username, event):
+        with self._lock:
+            self._outbox.append((self.origin, username, json.dumps(event), time.time()))
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute("""CREATE TABLE IF NOT EXISTS events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            origin TEXT NOT NULL,
+            username TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created REAL NOT NULL
+        )""")
+        return conn
+
+    def _run(self):
+        conn = None
+        last = None
+        pruned = time.time()
+        while True:
+            time.sleep(self.interval)
+            try:
+                if conn is None:
+                    conn = self._connect()
+                with self._lock:
+                    outbox, self._outbox = self._outbox, []
+                if outbox:
+                    conn.execute('BEGIN IMMEDIATE')
+                    conn.executemany('INSERT INTO events (origin, username, payload, created) VALUES (?, ?, ?, ?)',
+                                     outbox)
+                    conn.execute('COMMIT')
+                if time.time() - pruned > self.retention:
+                    conn.execute('DELETE FROM events WHERE created < ?', (time.time() - self.retention,))
+                    pruned = time.time()
+                if last is None or not self._bus.subscribers:
+                    # Nobody here to tell; just keep up with the end of the table
+                    last = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM events').fetchone()[0]
+                    continue
+                rows = conn.execute('SELECT seq, origin, username, payload FROM events WHERE seq > ? ORDER BY seq',
+                                    (last,)).fetchall()
+                for seq, origin, username, payload in rows:
+                    last = seq
+                    if origin == self.origin:
+                        continue
+                    event = json.loads(payload)
+                    # Versions count changes in the store of the process that made them
+                    event['version'] = None
+                    self._bus.deliver(username, event)
+            except sqlite3.Error as e:
+                print(f"Error passing task events through {self.path}: {e}")
+                if conn is not None:
+                    conn.close()
+                conn = None
+
+
+def make_change_bus():
+    broker = None if EVENT_BROKER in ('', 'off') else SqliteBroker(EVENT_BROKER)
+    return ChangeBus(broker)
@@ -0,0 +1,547 @@
+import asyncio
+import os
+import json
+import re
+import threading
+import time
+import importlib
+from collections import OrderedDict
+from generation_cache import AsyncSingleFlight, DecompositionCache, SingleFlight, cache_key
+from metrics import Callback, Histogram
+
+MODEL_ID = "mistralai/Mistral-7B-Instruct-v0.2"
+MAX_NEW_TOKENS = 1024
+TEMPERATURE = 0.7
+
+# TASK_MODEL=stub swaps Hugging Face for a local stand-in (tests, benchmarks, offline dev)
+MODEL_BACKEND = os.getenv('TASK_MODEL', 'huggingface')
+STUB_MODEL_DELAY = float(os.getenv('STUB_MODEL_DELAY', '0'))
+
+# Clients are kept per API key; the least recently used goes once there are too many
+CLIENT_POOL_MAX_KEYS = int(os.getenv('CLIENT_POOL_MAX_KEYS', '64'))
+CLIENT_IDLE_SECONDS = int(os.getenv('CLIENT_IDLE_SECONDS', '900'))
+
+# Where InferenceClient.text_generation sends its requests; the async path
+# (asgi.py) posts there itself with httpx
+HF_INFERENCE_URL = os.getenv('HF_INFERENCE_URL', 'https://router.huggingface.co/hf-inference/models/')
+MODEL_TIMEOUT_SECONDS = float(os.getenv('MODEL_TIMEOUT_SECONDS', '120'))
+ASYNC_MODEL_CONNECTIONS = int(os.getenv('ASYNC_MODEL_CONNECTIONS', '100'))
+
+PROMPT_TEMPLATE = """You are an AI task decomposition assistant. Your job is to help users break down complex tasks into manageable sub-tasks and steps.
+
+I need to break down this task into a structured format:
+
+{context}
+
+Please provide:
+1. A clear main task title
+2. A list of sub-tasks with estimated time
+3. For each sub-task, provide concrete actionable steps
+4. Suggest current emotions I might be feeling about this task
+5. Suggest emotions I might feel upon completion
+
+emotion_dict = (
+    "Anger": ["Aggressive", "Frustrated", "Distant", "Critical", "Hateful", "Resentful"],
+    "Disgust": ["Disapproval", "Disappointed", "Awful", "Avoidance", "Guilty"],
+    "Sad": ["Guilty", "Abandoned", "Despair", "Depressed", "Bored"],
+    "Happy": ["Optimistic", "Proud", "Joyful", "Interested", "Accepted"],
+    "Surprise": ["Startled", "Confused", "Amazed", "Excited"],
+    "Fear": ["Scared", "Anxious", "Insecure", "Rejected", "Helpless"],
+). 
+
+Format your response as a JSON object with the following structure:
+{{
+  "taskTitle": "Main task title",
+  "totalTimeEstimate": "Total estimated time (e.g., '2 hours')",
+  "currentEmotion": ["emotion1", "emotion2"],
+  "completionEmotion": ["emotion1", "emotion2"],
+  "subTasks": [
+    {{
+      "title": "Sub-task 1",
+      "totalTimeEstimate": "Estimated time (e.g., '30 minutes')",
+      "steps": [
+        "Step 1 description",
+        "Step 2 description"
+      ]
+    }}
+  ]
+}}"""
+
+class ClientPool:
+    """Long-lived InferenceClients keyed by API token.
+
+    huggingface_hub keeps one HTTP session (and its keep-alive connection
+    pool) per thread, so reusing clients from the generation worker
+    threads means repeat calls skip the TCP/TLS handshake.
+    """
+
+    def __init__(self, max_keys=CLIENT_POOL_MAX_KEYS, idle_seconds=CLIENT_IDLE_SECONDS, factory=None):
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        self.factory = factory or inference_client
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()  # token -> (client, last used)
+
+    def __len__(self):
+        return len(self._clients)
+
+    def get(self, token):
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.pop(token, None)
+            client = entry[0] if entry else self.factory(token=token)
+            self._clients[token] = (client, now)
+            while len(self._clients) > self.max_keys:
+                self._clients.popitem(last=False)
+            return client
+
+    def _evict_idle(self, now):
+        while self._clients:
+            token, (client, last_used) = next(iter(self._clients.items()))
+            if now - last_used < self.idle_seconds:
+                break
+            del self._clients[token]
+
+def inference_client(token):
+    # huggingface_hub takes longer to import than the rest of the app put
+    # together, so it's only imported for the first real model call
+    from huggingface_hub import InferenceClient
+    return InferenceClient(token=token)
+
+def warm_up():
+    """Import the model client now rather than on the first /generate."""
+    if MODEL_BACKEND != 'stub':
+        importlib.import_module('huggingface_hub')
+
+client_pool = ClientPool()
+decomposition_cache = DecompositionCache()
+# Identical prompts in flight at the same time share one model call
+model_calls = SingleFlight()
+async_model_calls = AsyncSingleFlight()
+_async_http = None
+
+model_call_seconds = Histogram('model_call_seconds', 'Time to get a task tree from the model',
+                               ('backend',), span='model_call')
+json_extract_seconds = Histogram('json_extract_seconds', 'Time to pull the task JSON out of a model reply',
+                                 span='json_extract')
+Callback('generation_cache_events_total', 'Model result cache lookups and stores',
+         lambda: {(event,): count for event, count in decomposition_cache.counters.items()},
+         labels=('event',), kind='counter')
+Callback('generation_coalesced_calls_total', 'Model calls shared with an identical one in flight',
+         lambda: model_calls.shared + async_model_calls.shared, kind='counter')
+
+def build_prompt(context):
+    return PROMPT_TEMPLATE.format(context=context)
+
+def generate_ai_result(context, user_api_key='', progress=None):
+    """Decompose context into a task tree with whichever model is configured.
+
+    With progress, the model's reply is streamed and progress(event, data)
+    is called with ('title', str) and each ('subtask', dict) as soon as it's
+    complete. A cached result, or one shared with an identical call already
+    in flight, reports them all at once.
+    """
+    model_id = 'stub' if MODEL_BACKEND == 'stub' else MODEL_ID
+    key = cache_key(context, model_id, max_new_tokens=MAX_NEW_TOKENS, temperature=TEMPERATURE)
+    cached = decomposition_cache.get(key)
+    if cached is not None:
+        task_data = cached
+    elif progress is None:
+        return model_calls.do(key, lambda: call_model(key, context, user_api_key))
+    else:
+        streamed = []
+
+        def call():
+            streamed.append(True)
+            return stream_model(key, context, user_api_key, progress)
+
+        task_data = model_calls.do(key, call)
+        if streamed:
+            return task_data
+    if progress is not None:
+        report_result(task_data, progress)
+    return task_data
+
+def call_model(key, context, user_api_key):
+    if MODEL_BACKEND == 'stub':
+        with model_call_seconds.time('stub'):
+            task_data = stub_model(context)
+    elif not user_api_key and not os.getenv("HUGGINGFACE_API_TOKEN"):
+        # Fallback to mock data for testing
+        return generate_mock_tasks(context)
+    else:
+        with model_call_seconds.time('huggingface'):
+            task_data = generate_tasks_with_huggingface(context, user_api_key)
+        if task_data is None:
+            return generate_mock_tasks(context)
+    
+    # Only real model output is cached, never the mock fallback
+    decomposition_cache.put(key, task_data)
+    return task_data
+
+def generate_tasks_with_huggingface(context, user_api_key=''):
+    """Generate tasks using Hugging Face API. Returns None if the model call fails."""
+    prompt = build_prompt(context)
+
+    try:
+        # If user has no API key, use the default one from .env
+        if not user_api_key:
+            user_api_key = os.getenv("HUGGINGFACE_API_TOKEN")
+            if not user_api_key:
+                return None
+        
+        # Reuse the client (and its warm connections) for this API key
+        client = client_pool.get(user_api_key)
+        
+        try:
+            # Use Mistral model
+            response = client.text_generation(
+                prompt,
+                model=MODEL_ID,
+                max_new_tokens=MAX_NEW_TOKENS,
+                temperature=TEMPERATURE,
+                return_full_text=False
+            )
+            result = response.strip()
+            
+            # Clean up the response to extract just the JSON part
+            return extract_task_json(result)
+                
+        except Exception as e:
+            print(f"Error with Mistral model: {str(e)}")
+            # If user's API key fails, try the default one
+            default_key = os.getenv("HUGGINGFACE_API_TOKEN")
+            if default_key and user_api_key != default_key:
+                print("Falling back to default API key")
+                return generate_tasks_with_huggingface(context, default_key)
+            return None
+            
+    except Exception as e:
+        print(f"Error generating tasks with Hugging Face: {e}")
+        return None
+
+async def generate_ai_result_async(context, user_api_key='', progress=None):
+    """generate_ai_result for the event loop: the model call is awaited, disk cache I/O runs on a thread."""
+    model_id = 'stub' if MODEL_BACKEND == 'stub' else MODEL_ID
+    key = cache_key(context, model_id, max_new_tokens=MAX_NEW_TOKENS, temperature=TEMPERATURE)
+    loop = asyncio.get_running_loop()
+    cached = await loop.run_in_executor(None, decomposition_cache.get, key)
+    if cached is not None:
+        task_data = cached
+    elif progress is None:
+        return await async_model_calls.do(key, lambda: call_model_async(key, context, user_api_key))
+    else:
+        streamed = []
+
+        def call():
+            streamed.append(True)
+            return stream_model_async(key, context, user_api_key, progress)
+
+        task_data = await async_model_calls.do(key, call)
+        if streamed:
+            return task_data
+    if progress is not None:
+        report_result(task_data, progress)
+    return task_data
+
+async def call_model_async(key, context, user_api_key):
+    if MODEL_BACKEND == 'stub':
+        with model_call_seconds.time('stub'):
+            task_data = await stub_model_async(context)
+    elif not user_api_key and not os.getenv("HUGGINGFACE_API_TOKEN"):
+        return generate_mock_tasks(context)
+    else:
+        with model_call_seconds.time('huggingface'):
+            task_data = await generate_tasks_with_huggingface_async(context, user_api_key)
+        if task_data is None:
+            return generate_mock_tasks(context)
+    
+    await asyncio.get_running_loop().run_in_executor(None, decomposition_cache.put, key, task_data)
+    return task_data
+
+async def stream_model_async(key, context, user_api_key, progress):
+    """stream_model for the event loop."""
+    if MODEL_BACKEND != 'stub' and not user_api_key and not os.getenv("HUGGINGFACE_API_TOKEN"):
+        task_data = generate_mock_tasks(context)
+        report_result(task_data, progress)
+        return task_data
+    parser = SubtaskStreamParser()
+    with model_call_seconds.time('stub' if MODEL_BACKEND == 'stub' else 'huggingface'):
+        try:
+            async for token in stream_model_tokens_async(context, user_api_key):
+                for event, data in parser.feed(token):
+                    progress(event, data)
+        except Exception as e:
+            print(f"Error streaming from Mistral model: {e}")
+    # The cache write goes to disk, so finish off the loop
+    return await asyncio.get_running_loop().run_in_executor(None, finish_stream, key, context, parser, progress)
+
+async def stream_model_tokens_async(context, user_api_key=''):
+    """stream_model_tokens with httpx: the text of each token as the model sends it."""
+    if MODEL_BACKEND == 'stub':
+        async for chunk in stub_model_tokens_async(context):
+            yield chunk
+        return
+    token = user_api_key or os.getenv("HUGGINGFACE_API_TOKEN")
+    async with async_http_client().stream(
+        'POST',
+        HF_INFERENCE_URL + MODEL_ID,
+        headers={'Authorization': f'Bearer {token}'},
+        json={
+            'inputs': build_prompt(context),
+            'parameters': {
+                'max_new_tokens': MAX_NEW_TOKENS,
+                'temperature': TEMPERATURE,
+                'return_full_text': False,
+            },
+            'stream': True,
+        },
+    ) as response:
+        response.raise_for_status()
+        # Server-sent events, one {"token": {"text": ...}, ...} per data line
+        async for line in response.aiter_lines():
+            if line.startswith('data:'):
+                yield json.loads(line[5:])['token']['text']
+
+def async_http_client():
+    # One connection pool for every API key: the key goes in each request's header
+    global _async_http
+    if _async_http is None:
+        import httpx
+        _async_http = httpx.AsyncClient(
+            timeout=MODEL_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=ASYNC_MODEL_CONNECTIONS),
+        )
+    return _async_http
+
+async def generate_tasks_with_huggingface_async(context, user_api_key=''):
+    """generate_tasks_with_huggingface with httpx on the event loop. Returns None if the model call fails."""
+    if not user_api_key:
+        user_api_key = os.getenv("HUGGINGFACE_API_TOKEN")
+        if not user_api_key:
+            return None
+    
+    try:
+        response = await async_http_client().post(
+            HF_INFERENCE_URL + MODEL_ID,
+            headers={'Authorization': f'Bearer {user_api_key}'},
+            json={
+                'inputs': build_prompt(context),
+                'parameters': {
+                    'max_new_tokens': MAX_NEW_TOKENS,
+                    'temperature': TEMPERATURE,
+                    'return_full_text': False,
+                },
+            },
+        )
+        response.raise_for_status()
+        reply = response.json()
+        # A list with one {"generated_text": ...} per input
+        if isinstance(reply, list):
+            reply = reply[0]
+        return extract_task_json(reply['generated_text'].strip())
+    except Exception as e:
+        print(f"Error with Mistral model: {str(e)}")
+        # If user's API key fails, try the default one
+        default_key = os.getenv("HUGGINGFACE_API_TOKEN")
+        if default_key and user_api_key != default_key:
+            print("Falling back to default API key")
+            return await generate_tasks_with_huggingface_async(context, default_key)
+        return None
+
+def extract_task_json(result):
+    """Pull the JSON object out of the model's reply, or None if there isn't one."""
+    with json_extract_seconds.time():
+        return parse_task_json(result)
+
+def parse_task_json(result):
+    if "{" in result and "}" in result:
+        json_start = result.find("{")
+        json_end = result.rfind("}") + 1
+        json_str = result[json_start:json_end]
+        
+        # Parse JSON
+        try:
+            return json.loads(json_str)
+        except json.JSONDecodeError as e:
+            print(f"JSON decode error: {e}")
+            return None
+    else:
+        print("No valid JSON found in response")
+        return None
+
+def stream_model(key, context, user_api_key, progress):
+    """call_model, but streaming the reply and reporting each piece of it to progress."""
+    if MODEL_BACKEND != 'stub' and not user_api_key and not os.getenv("HUGGINGFACE_API_TOKEN"):
+        task_data = generate_mock_tasks(context)
+        report_result(task_data, progress)
+        return task_data
+    parser = SubtaskStreamParser()
+    with model_call_seconds.time('stub' if MODEL_BACKEND == 'stub' else 'huggingface'):
+        try:
+            for token in stream_model_tokens(context, user_api_key):
+                for event, data in parser.feed(token):
+                    progress(event, data)
+        except Exception as e:
+            print(f"Error streaming from Mistral model: {e}")
+    return finish_stream(key, context, parser, progress)
+
+def finish_stream(key, context, parser, progress):
+    """The task tree from a streamed reply, falling back to what was parsed or to mock data."""
+    task_data = extract_task_json(parser.text.strip())
+    if task_data is not None:
+        decomposition_cache.put(key, task_data)
+    elif parser.subtasks:
+        # The reply was cut off, but the subtasks we already reported are real
+        task_data = {"taskTitle": parser.title or context, "subTasks": parser.subtasks}
+    else:
+        task_data = generate_mock_tasks(context)
+        report_result(task_data, progress)
+    return task_data
+
+def report_result(task_data, progress):
+    """Report an already complete tree the way stream_model would have."""
+    progress('title', task_data.get('taskTitle', ''))
+    for sub in task_data.get('subTasks') or []:
+        progress('subtask', sub)
+
+def stream_model_tokens(context, user_api_key=''):
+    if MODEL_BACKEND == 'stub':
+        yield from stub_model_tokens(context)
+        return
+    token = user_api_key or os.getenv("HUGGINGFACE_API_TOKEN")
+    client = client_pool.get(token)
+    yield from client.text_generation(
+        build_prompt(context),
+        model=MODEL_ID,
+        max_new_tokens=MAX_NEW_TOKENS,
+        temperature=TEMPERATURE,
+        return_full_text=False,
+        stream=True
+    )
+
+class SubtaskStreamParser:
+    """Incremental parser for the model's JSON reply.
+
+    feed() takes chunks of text and returns events for anything that
+    became complete: the task title, and each object in "subTasks".
+    """
+
+    TITLE_RE = re.compile(r'"taskTitle"\s*:\s*("(?:[^"\\]|\\.)*")')
+    SUBTASKS_RE = re.compile(r'"subTasks"\s*:\s*\[')
+
+    def __init__(self):
+        self.text = ''
+        self.title = None
+        self.subtasks = []
+        self._pos = None  # where to resume scanning inside the subTasks array
+        self._depth = 0
+        self._start = None
+        self._in_string = False
+        self._escaped = False
+        self._finished = False
+
+    def feed(self, chunk):
+        self.text += chunk
+        events = []
+        if self.title is None:
+            match = self.TITLE_RE.search(self.text)
+            if match:
+                self.title = json.loads(match.group(1))
+                events.append(('title', self.title))
+        if self._pos is None:
+            match = self.SUBTASKS_RE.search(self.text)
+            if not match:
+                return events
+            self._pos = match.end()
+        if not self._finished:
+            events.extend(self._scan())
+        return events
+
+    def _scan(self):
+        events = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == '\\':
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{':
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif ch == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        subtask = json.loads(text[self._start:i + 1])
+                    except json.JSONDecodeError:
+                        continue
+                    self.subtasks.append(subtask)
+                    events.append(('subtask', subtask))
+            elif ch == ']' and self._depth == 0:
+                self._finished = True
+                break
+        self._pos = len(text)
+        return events
+
+def stub_model_tokens(context):
+    """Streaming version of stub_model: the mock JSON in small chunks."""
+    chunks = stub_reply_chunks(context)
+    for chunk in chunks:
+        if STUB_MODEL_DELAY:
+            time.sleep(STUB_MODEL_DELAY / len(chunks))
+        yield chunk
+
+async def stub_model_tokens_async(context):
+    chunks = stub_reply_chunks(context)
+    for chunk in chunks:
+        if STUB_MODEL_DELAY:
+            await asyncio.sleep(STUB_MODEL_DELAY / len(chunks))
+        yield chunk
+
+def stub_reply_chunks(context):
+    reply = json.dumps(generate_mock_tasks(context), indent=2)
+    return [reply[i:i + 8] for i in range(0, len(reply), 8)]
+
+def stub_model(context):
+    """Local stand-in for the model: mock tasks after STUB_MODEL_DELAY seconds."""
+    if STUB_MODEL_DELAY:
+        time.sleep(STUB_MODEL_DELAY)
+    return generate_mock_tasks(context)
+
+async def stub_model_async(context):
+    if STUB_MODEL_DELAY:
+        await asyncio.sleep(STUB_MODEL_DELAY)
+    return generate_mock_tasks(context)
+
+def generate_mock_tasks(context):
+    """Generate mock tasks for testing"""
+    # Create a simple task structure based on the context
+    words = context.split()
+    main_task = " ".join(words[:min(5, len(words))]) + " Task"
+    
+    return {
+        "taskTitle": main_task,
+        "subTasks": [
+            {
+                "title": f"Plan {main_task}",
+                "steps": ["Research requirements", "Define scope", "Set timeline"]
+            },
+            {
+                "title": f"Execute {main_task}",
+                "steps": ["Complete first part", "Review progress", "Finish remaining items"]
+            },
+            {
+                "title": f"Review {main_task}",
+                "steps": ["Check for errors", "Get feedback", "Make final adjustments"]
+            }
+        ]
+    }
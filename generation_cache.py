@@ -0,0 +1,224 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+GENERATION_CACHE_SIZE = int(os.getenv('GENERATION_CACHE_SIZE', '256'))
+# Set GENERATION_CACHE_DIR to also keep results on disk, shared by all workers
+GENERATION_CACHE_DIR = os.getenv('GENERATION_CACHE_DIR', '')
+GENERATION_CACHE_TTL = int(os.getenv('GENERATION_CACHE_TTL', str(7 * 24 * 3600)))
+GENERATION_CACHE_DISK_BYTES = int(os.getenv('GENERATION_CACHE_DISK_BYTES', str(64 * 1024 * 1024)))
+
+
+def normalize_context(context):
+    """Case and whitespace differences shouldn't cost another model call."""
+    return re.sub(r'\s+', ' ', context).strip().lower()
+
+
+def cache_key(context, model_id, **params):
+    payload = json.dumps([normalize_context(context), model_id, params], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class DecompositionCache:
+    """Parsed model results keyed by cache_key().
+
+    A small LRU in memory, backed by an optional directory of JSON files
+    that expire after ttl seconds and are trimmed, oldest first, to
+    max_disk_bytes.
+    """
+
+    def __init__(self, size=GENERATION_CACHE_SIZE, directory=GENERATION_CACHE_DIR,
+                 ttl=GENERATION_CACHE_TTL, max_disk_bytes=GENERATION_CACHE_DISK_BYTES):
+        self.size = size
+        self.directory = directory
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (result, stored at)
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._disk_bytes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return copy.deepcopy(entry[0])
+        result = self._disk_get(key, now)
+        with self._lock:
+            if result is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['disk_hits'] += 1
+            self._remember(key, result, now)
+        return copy.deepcopy(result)
+
+    def put(self, key, result):
+        now = time.time()
+        result = copy.deepcopy(result)
+        with self._lock:
+            self.counters['stores'] += 1
+            self._remember(key, result, now)
+        if self.directory:
+            self._disk_put(key, result)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_bytes'] = self._disk_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_ratio'] = round((lookups - stats['misses']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _remember(self, key, result, now):
+        self._memory[key] = (result, now)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.size:
+            self._memory.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _disk_get(self, key, now):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            if now - os.path.getmtime(path) >= self.ttl:
+                self._disk_remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, key, result):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        data = json.dumps(result)
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing generation cache entry: {e}")
+            return
+        with self._lock:
+            self._disk_bytes += len(data)
+            over_budget = self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._trim_disk()
+
+    def _disk_remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes -= size
+            self.counters['evictions'] += 1
+
+    def _disk_entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _trim_disk(self):
+        """Drop expired entries, then the oldest ones until we're back to 90% of the budget."""
+        now = time.time()
+        entries = sorted(self._disk_entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_disk_bytes * 0.9
+        for path, size, mtime in entries:
+            if total <= target and now - mtime < self.ttl:
+                break
+            self._disk_remove(path)
+            total -= size
+        with self._lock:
+            # Other workers write to the same directory, so resync with what's really there
+            self._disk_bytes = total
+
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one call of fn."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> [event, result, error]
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [threading.Event(), None, None]
+            else:
+                self.shared += 1
+        if leader:
+            try:
+                call[1] = fn()
+            except Exception as e:
+                call[2] = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call[0].set()
+        else:
+            call[0].wait()
+        if call[2] is not None:
+            raise call[2]
+        # Each follower gets its own copy, like a cache hit
+        return call[1] if leader else copy.deepcopy(call[1])
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop."""
+
+    def __init__(self):
+        self._calls = {}  # key -> future
+        self.shared = 0
+
+    async def do(self, key, fn):
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            # shield: one follower giving up mustn't cancel the call for everyone
+            return copy.deepcopy(await asyncio.shield(future))
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; don't let asyncio warn about it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+            if not future.done():
+                future.cancel()
@@ -0,0 +1,160 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', '4'))
+# Jobs waiting or running across all users before /generate starts refusing work
+MAX_PENDING_JOBS = int(os.getenv('MAX_PENDING_JOBS', '32'))
+MAX_JOBS_PER_USER = int(os.getenv('MAX_JOBS_PER_USER', '2'))
+# Finished jobs are kept this long so clients can still fetch the result
+JOB_TTL_SECONDS = int(os.getenv('JOB_TTL_SECONDS', '600'))
+
+
+class JobRejected(Exception):
+    """Raised by submit() when the queue or the user's quota is full."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+class JobQueue:
+    """Runs fn(username, *args, progress=...) on a bounded pool of worker threads.
+
+    Jobs are plain dicts with 'id', 'status' (queued, running, done or
+    error), 'result' and 'error', so they can be returned with jsonify.
+    Submitting with a key the same user already has queued or running
+    returns that job instead of starting another one. fn can call
+    progress(event, data) to add partial results to the job's 'progress'
+    list while it runs.
+
+    After run_on(loop, coroutine_fn), jobs run as coroutines on that event
+    loop instead (see asgi.py), so waiting on the model holds no thread.
+    """
+
+    def __init__(self, fn, workers=GENERATION_WORKERS, max_pending=MAX_PENDING_JOBS,
+                 per_user=MAX_JOBS_PER_USER):
+        self.fn = fn
+        self.max_pending = max_pending
+        self.per_user = per_user
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='generate')
+        self._changed = threading.Condition()
+        self._jobs = {}
+        self._active = {}  # username -> number of queued or running jobs
+        self._inflight = {}  # (username, key) -> queued or running job
+        self._listeners = []
+        self._loop = None
+        self._coroutine_fn = None
+
+    def submit(self, username, *args, key=None):
+        with self._changed:
+            self._expire()
+            if key is not None and (username, key) in self._inflight:
+                return self._inflight[(username, key)]
+            pending = sum(self._active.values())
+            if pending >= self.max_pending:
+                raise JobRejected('Server is busy, please try again shortly', 503)
+            if self._active.get(username, 0) >= self.per_user:
+                raise JobRejected('You already have tasks being generated', 429)
+            job = {
+                'id': uuid.uuid4().hex,
+                'username': username,
+                'status': 'queued',
+                'result': None,
+                'error': None,
+                'created_at': time.time(),
+                'finished_at': None,
+                'key': key,
+                'progress': [],  # (event, data) pairs, in the order fn reported them
+            }
+            self._jobs[job['id']] = job
+            if key is not None:
+                self._inflight[(username, key)] = job
+            self._active[username] = self._active.get(username, 0) + 1
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._run_async(job, args), self._loop)
+        else:
+            self._pool.submit(self._run, job, args)
+        return job
+
+    def run_on(self, loop, coroutine_fn, max_pending=None):
+        """Run jobs submitted from now on as coroutine_fn(username, *args) on loop."""
+        with self._changed:
+            self._loop = loop
+            self._coroutine_fn = coroutine_fn
+            if max_pending is not None:
+                self.max_pending = max_pending
+
+    def add_listener(self, fn):
+        """Call fn(job) from whichever thread changes a job's status or adds to its progress."""
+        self._listeners.append(fn)
+
+    def get(self, job_id, username=None):
+        job = self._jobs.get(job_id)
+        if job is None or (username is not None and job['username'] != username):
+            return None
+        return job
+
+    def wait(self, job_id, status, timeout, seen=None):
+        """Block until the job's status differs from status, or timeout passes.
+
+        With seen, also return once the job has more than seen progress events.
+        """
+        def changed():
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != status:
+                return True
+            return seen is not None and len(job['progress']) > seen
+
+        with self._changed:
+            self._changed.wait_for(changed, timeout)
+            return self._jobs.get(job_id)
+
+    def _run(self, job, args):
+        self._update(job, status='running')
+        try:
+            result = self.fn(job['username'], *args, progress=partial(self._progress, job))
+        except Exception as e:
+            print(f"Error in generation job {job['id']}: {e}")
+            self._update(job, status='error', error=str(e))
+        else:
+            self._update(job, status='done', result=result)
+
+    async def _run_async(self, job, args):
+        self._update(job, status='running')
+        try:
+            result = await self._coroutine_fn(job['username'], *args, progress=partial(self._progress, job))
+        except Exception as e:
+            print(f"Error in generation job {job['id']}: {e}")
+            self._update(job, status='error', error=str(e))
+        else:
+            self._update(job, status='done', result=result)
+
+    def _progress(self, job, event, data):
+        with self._changed:
+            job['progress'].append((event, data))
+            self._changed.notify_all()
+        for listener in self._listeners:
+            listener(job)
+
+    def _update(self, job, **fields):
+        with self._changed:
+            job.update(fields)
+            if job['status'] in ('done', 'error'):
+                job['finished_at'] = time.time()
+                self._inflight.pop((job['username'], job['key']), None)
+                self._active[job['username']] -= 1
+                if not self._active[job['username']]:
+                    del self._active[job['username']]
+            self._changed.notify_all()
+        for listener in self._listeners:
+            listener(job)
+
+    def _expire(self):
+        cutoff = time.time() - JOB_TTL_SECONDS
+        for job_id in [j['id'] for j in self._jobs.values() if j['finished_at'] and j['finished_at'] < cutoff]:
+            del self._jobs[job_id]
@@ -0,0 +1,149 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from a journal append to a slow model call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics = []
+_local = threading.local()
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, one series per combination of labels.
+
+    Timers with a span name also add their duration to the current request's
+    spans (see collect_spans), so a slow response can say where its time went.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, span=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.span = span
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(elapsed, *label_values)
+            if self.span:
+                add_span(self.span, elapsed)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        for label_values, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{label_text(self.labels, label_values, le=bound)} {cumulative}")
+            labels = label_text(self.labels, label_values)
+            lines.append(f"{self.name}_bucket{label_text(self.labels, label_values, le='+Inf')} {values[-2]}")
+            lines.append(f"{self.name}_count{labels} {values[-2]}")
+            lines.append(f"{self.name}_sum{labels} {values[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f"{self.name}{label_text(self.labels, k)} {v}" for k, v in values)
+        return lines
+
+
+class Callback:
+    """A gauge or counter whose value is read from fn() at scrape time.
+
+    fn returns a number, or a dict of label values tuple -> number.
+    """
+
+    def __init__(self, name, help, fn, labels=(), kind='gauge'):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = labels
+        self.kind = kind
+        _metrics.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            values = self.fn()
+        except Exception as e:
+            print(f"Error reading metric {self.name}: {e}")
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines.extend(f"{self.name}{label_text(self.labels, k)} {v}" for k, v in sorted(values.items()))
+        return lines
+
+
+def label_text(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render():
+    """Every metric in the Prometheus text format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+#############################
+# Per-request spans         #
+#############################
+
+def collect_spans():
+    """Start collecting span timings on this thread (one request)."""
+    _local.spans = {}
+
+def add_span(name, seconds):
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+def finish_spans():
+    """Stop collecting and return {span name: seconds} for this thread."""
+    spans = getattr(_local, 'spans', None) or {}
+    _local.spans = None
+    return spans
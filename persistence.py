@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+
+from metrics import Histogram
+
+# Changes arriving within this many milliseconds are written together
+PERSIST_WINDOW_MS = float(os.getenv('PERSIST_WINDOW_MS', '20'))
+# PERSIST_SYNC=1 makes every request wait until its change is on disk
+PERSIST_SYNC = os.getenv('PERSIST_SYNC', '0') == '1'
+# flush() gives up after this long rather than hang while the writer retries
+PERSIST_FLUSH_TIMEOUT = float(os.getenv('PERSIST_FLUSH_TIMEOUT', '30'))
+
+storage_write_seconds = Histogram('storage_write_seconds', 'Time to write one batch of task changes')
+# Only requests made with wait=True spend this; the rest return before the write
+persist_wait_seconds = Histogram('persist_wait_seconds', 'Time requests wait for their changes to be written',
+                                 span='persist_wait')
+
+
+class GroupCommitWriter:
+    """Single writer thread in front of a Storage.
+
+    submit() queues journal-style records and returns; the writer thread
+    waits PERSIST_WINDOW_MS for more to arrive and hands everything to
+    storage.apply_records() as one write. Callers that need durability
+    pass wait=True and block until their records have been written.
+    Callers holding a lock that orders their changes enqueue() under it
+    and wait() once it's released, so concurrent requests share a write
+    instead of taking turns at it.
+
+    It also remembers the storage stamp right after each of its own
+    writes, so stale() only reports changes made by other processes. A
+    stamp that moved before one of our writes means someone else wrote
+    first, and stays stale until mark_loaded().
+    """
+
+    def __init__(self, storage, window_ms=PERSIST_WINDOW_MS):
+        self.storage = storage
+        self.window = window_ms / 1000.0
+        self._cond = threading.Condition()
+        self._pending = []  # records waiting to be written
+        self._waiters = []  # [event, error] for each wait=True submit in _pending
+        self._writing = False
+        self._closed = False
+        # Serialises writes with stamp checks
+        self._io_lock = threading.Lock()
+        self._stamp = storage.stamp()
+        self._foreign_write = False
+        # The last failed write's error, and how many writes have failed
+        self._error = None
+        self._failures = 0
+        self.flushes = 0
+        self.records_written = 0
+        self._thread = threading.Thread(target=self._run, name='task-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, records, wait=PERSIST_SYNC):
+        self.wait(self.enqueue(records, wait))
+
+    def enqueue(self, records, wait=PERSIST_SYNC):
+        """Queue records and return straight away.
+
+        With wait=True the result is a waiter to pass to wait(); otherwise None.
+        """
+        if not records:
+            return None
+        # Copy the tasks now; the dicts keep changing after we return
+        records = [dict(r, task=r['task'].copy()) if r['op'] == 'put' else r for r in records]
+        waiter = [threading.Event(), None] if wait else None
+        with self._cond:
+            self._pending.extend(records)
+            if waiter:
+                self._waiters.append(waiter)
+            self._cond.notify_all()
+        return waiter
+
+    def wait(self, waiter):
+        """Block until the records behind an enqueue() waiter are written, raising the write's error."""
+        if waiter is None:
+            return
+        with persist_wait_seconds.time():
+            waiter[0].wait()
+        if waiter[1] is not None:
+            raise waiter[1]
+
+    def flush(self, timeout=PERSIST_FLUSH_TIMEOUT):
+        """Block until everything submitted so far has been written.
+
+        Raises the error of a write that fails meanwhile, or TimeoutError,
+        so callers fail fast while the writer keeps retrying.
+        """
+        with self._cond:
+            failures = self._failures
+            self._cond.notify_all()
+            written = self._cond.wait_for(
+                lambda: (not self._pending and not self._writing) or self._failures != failures, timeout)
+            if self._failures != failures:
+                raise self._error
+            if not written:
+                raise TimeoutError(f"Task changes not written after {timeout} seconds")
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error writing tasks on shutdown, unwritten changes are lost: {e}")
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
+
+    def stale(self):
+        """True if another process has written since our last write or mark_loaded()."""
+        with self._io_lock:
+            return self._foreign_write or self.storage.stamp() != self._stamp
+
+    def mark_loaded(self):
+        with self._io_lock:
+            self._stamp = self.storage.stamp()
+            self._foreign_write = False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if self._closed and not self._pending:
+                    return
+            # Let more changes pile up behind the first one
+            time.sleep(self.window)
+            with self._cond:
+                records, self._pending = self._pending, []
+                waiters, self._waiters = self._waiters, []
+                self._writing = True
+            error = None
+            try:
+                with self._io_lock, storage_write_seconds.time():
+                    before, after = self.storage.apply_records(coalesce(records))
+                    if before != self._stamp:
+                        self._foreign_write = True
+                    self._stamp = after
+                self.flushes += 1
+                self.records_written += len(records)
+            except Exception as e:
+                print(f"Error writing tasks, will retry: {e}")
+                error = e
+            with self._cond:
+                if error is not None:
+                    # Keep the records and try again with whatever arrived meanwhile
+                    self._pending[:0] = records
+                    self._error = error
+                    self._failures += 1
+                self._writing = False
+                self._cond.notify_all()
+            for waiter in waiters:
+                waiter[1] = error
+                waiter[0].set()
+            if error is not None:
+                time.sleep(1)
+
+
+def coalesce(records):
+    """Drop puts that a later put or delete of the same task makes redundant."""
+    out = []
+    last_put = {}
+    for record in records:
+        if record['op'] == 'put':
+            key = (record['task'].username, record['task'].id)
+            if key in last_put:
+                out[last_put[key]] = None
+            last_put[key] = len(out)
+        else:
+            for task_id in record['ids']:
+                index = last_put.pop((record['username'], task_id), None)
+                if index is not None:
+                    out[index] = None
+        out.append(record)
+    return [r for r in out if r is not None]
@@ -0,0 +1,62 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+
+# PROFILE_REQUESTS=header profiles requests sent with an "X-Profile: 1" header,
+# =all profiles every request. Off by default: cProfile slows everything down.
+PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', 'off')
+PROFILE_HEADER = 'X-Profile'
+# Also keep each profile as a .prof file here, for snakeviz or pstats
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', '25'))
+
+
+class RequestProfiler:
+    """cProfile around single requests.
+
+    Only one profile can run at a time in a process, so a request that
+    arrives while another is being profiled just isn't profiled. cProfile
+    only sees the request's own thread: time spent in the task writer or the
+    generation workers shows up in the metrics instead.
+    """
+
+    def __init__(self, mode=PROFILE_REQUESTS, directory=PROFILE_DIR, top=PROFILE_TOP):
+        self.mode = mode
+        self.directory = directory
+        self.top = top
+        self._busy = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def wanted(self, headers):
+        if self.mode == 'all':
+            return True
+        return self.mode == 'header' and headers.get(PROFILE_HEADER, '') not in ('', '0')
+
+    def start(self):
+        """A running profile, or None if another request holds the profiler."""
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Some other profiler (a debugger, say) is already active
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile, label):
+        """Stop the profile and print its top functions by cumulative time."""
+        profile.disable()
+        self._busy.release()
+        out = io.StringIO()
+        stats = pstats.Stats(profile, stream=out)
+        stats.sort_stats('cumulative').print_stats(self.top)
+        print(f"Profile for {label}:\n{out.getvalue()}")
+        if self.directory:
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident()}.prof"
+            stats.dump_stats(os.path.join(self.directory, name))
@@ -0,0 +1,104 @@
+from collections import Counter
+
+from search_index import emotion_tags
+
+
+class Rollups:
+    """Task counts, completed counts and seconds spent, summed up each tree.
+
+    Maintained by TaskStore, under its lock, from the same insert, unlink and
+    touch calls as its other indexes. Each change only walks the task's
+    parent chain. tasks and children are the store's own dicts.
+    """
+
+    def __init__(self, tasks, children):
+        self._tasks = tasks
+        self._children = children
+        # (username, id) -> [tasks, completed, seconds] for the task and everything under it
+        self._totals = {}
+        # (username, id) -> (completed, seconds, current tags, completion tags) of the task alone
+        self._own = {}
+        # username -> [tasks, completed, seconds]
+        self._users = {}
+        # username -> {'current': Counter, 'completion': Counter} of emotion tags
+        self._emotions = {}
+
+    def add(self, task):
+        own = self._own_values(task)
+        self._own[(task.username, task.id)] = own
+        totals = [1, own[0], own[1]]
+        # Children can arrive before their parent when loading; count them in now
+        for child_id in self._children.get((task.username, task.id), ()):
+            child_totals = self._totals.get((task.username, child_id))
+            if child_totals:
+                totals = [a + b for a, b in zip(totals, child_totals)]
+        self._totals[(task.username, task.id)] = totals
+        self._propagate(task, totals)
+        self._count_user(task.username, (1, own[0], own[1]), own[2], own[3], 1)
+
+    def remove(self, task):
+        key = (task.username, task.id)
+        totals = self._totals.pop(key, None)
+        own = self._own.pop(key, None)
+        if totals is None:
+            return
+        self._propagate(task, [-value for value in totals])
+        self._count_user(task.username, (-1, -own[0], -own[1]), own[2], own[3], -1)
+
+    def update(self, task):
+        """Pick up in-place edits to completed, timeSpent or the emotions."""
+        key = (task.username, task.id)
+        old = self._own.get(key)
+        if old is None:
+            return
+        new = self._own_values(task)
+        if new == old:
+            return
+        self._own[key] = new
+        delta = [0, new[0] - old[0], new[1] - old[1]]
+        totals = self._totals[key]
+        for i, value in enumerate(delta):
+            totals[i] += value
+        self._propagate(task, delta)
+        self._count_user(task.username, delta, old[2], old[3], -1)
+        self._count_user(task.username, (0, 0, 0), new[2], new[3], 1)
+
+    def totals(self, username, task_id):
+        return self._totals.get((username, task_id))
+
+    def user_totals(self, username):
+        return list(self._users.get(username, [0, 0, 0]))
+
+    def emotions(self, username):
+        hist = self._emotions.get(username, {})
+        return {kind: dict(hist.get(kind, Counter()).most_common()) for kind in ('current', 'completion')}
+
+    def _own_values(self, task):
+        return (int(bool(task.completed)), task.timeSpent or 0,
+                tuple(emotion_tags(task.currentEmotion)), tuple(emotion_tags(task.completionEmotion)))
+
+    def _propagate(self, task, delta):
+        """Add delta to every ancestor of task that is loaded."""
+        seen = {task.id}
+        parent_id = task.parent_id
+        # parent_id 0 marks a root
+        while parent_id and parent_id not in seen:
+            totals = self._totals.get((task.username, parent_id))
+            if totals is None:
+                break
+            for i, value in enumerate(delta):
+                totals[i] += value
+            seen.add(parent_id)
+            parent_id = self._tasks[(task.username, parent_id)].parent_id
+
+    def _count_user(self, username, delta, current, completion, sign):
+        totals = self._users.setdefault(username, [0, 0, 0])
+        for i, value in enumerate(delta):
+            totals[i] += value
+        if current or completion:
+            hist = self._emotions.setdefault(username, {'current': Counter(), 'completion': Counter()})
+            for kind, tags in (('current', current), ('completion', completion)):
+                for tag in tags:
+                    hist[kind][tag] += sign
+                    if hist[kind][tag] <= 0:
+                        del hist[kind][tag]
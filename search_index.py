@@ -0,0 +1,108 @@
+import json
+import math
+import re
+import sys
+from collections import Counter
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.casefold()) if text else []
+
+def index_terms(task):
+    # Interned, so each distinct word is stored once however many tasks use it
+    return tuple(sys.intern(term) for term in tokenize(task.text))
+
+def index_tags(task):
+    return frozenset(emotion_tags(task.currentEmotion) + emotion_tags(task.completionEmotion))
+
+def emotion_tags(value):
+    """Tags in a stored emotion field, read the way parseEmotions in script.js reads them."""
+    if not value:
+        return []
+    if value.startswith('['):
+        try:
+            tags = json.loads(value)
+        except ValueError:
+            tags = None
+        if isinstance(tags, list):
+            return [str(tag).strip().casefold() for tag in tags if str(tag).strip()]
+        value = value.strip('[]').replace('"', '').replace("'", '')
+    return [tag.casefold() for tag in re.split(r'[,\s]+', value) if tag]
+
+
+class SearchIndex:
+    """Per-user inverted index over task text and emotion tags.
+
+    Maintained by TaskStore as tasks are inserted, edited and removed, under
+    the store's lock. Text terms are ranked tf-idf style within the user's
+    own tasks; tags are only used as filters.
+    """
+
+    def __init__(self):
+        # username -> {term: {task id: count}}
+        self._postings = {}
+        # username -> {tag: {task id: None}}
+        self._tags = {}
+        # (username, task id) -> (terms, tags) as indexed
+        self._docs = {}
+        # username -> number of indexed tasks
+        self._sizes = {}
+
+    def add(self, task):
+        terms = index_terms(task)
+        tags = index_tags(task)
+        self._docs[(task.username, task.id)] = (terms, tags)
+        self._sizes[task.username] = self._sizes.get(task.username, 0) + 1
+        postings = self._postings.setdefault(task.username, {})
+        for term, count in Counter(terms).items():
+            postings.setdefault(term, {})[task.id] = count
+        user_tags = self._tags.setdefault(task.username, {})
+        for tag in tags:
+            user_tags.setdefault(tag, {})[task.id] = None
+
+    def remove(self, task):
+        doc = self._docs.pop((task.username, task.id), None)
+        if doc is None:
+            return
+        terms, tags = doc
+        self._sizes[task.username] -= 1
+        for index, keys in ((self._postings, terms), (self._tags, tags)):
+            user_index = index.get(task.username, {})
+            for key in keys:
+                ids = user_index.get(key)
+                if ids is not None:
+                    ids.pop(task.id, None)
+                    if not ids:
+                        del user_index[key]
+
+    def update(self, task):
+        """Re-index a task whose text or emotions may have been edited in place."""
+        doc = self._docs.get((task.username, task.id))
+        if doc is not None:
+            if doc == (index_terms(task), index_tags(task)):
+                return
+            self.remove(task)
+        self.add(task)
+
+    def search(self, username, terms, tag=None):
+        """[(task id, score)] for tasks containing every term (and the tag), best first."""
+        postings = self._postings.get(username, {})
+        lists = [postings.get(term) for term in set(terms)]
+        if tag is not None:
+            lists.append(self._tags.get(username, {}).get(tag))
+        if not lists or any(not ids for ids in lists):
+            return []
+        # Walk the shortest list and probe the others
+        lists.sort(key=len)
+        candidates = [tid for tid in lists[0] if all(tid in ids for ids in lists[1:])]
+        size = self._sizes.get(username, 0)
+        weights = {term: math.log(1 + size / len(postings[term])) for term in set(terms)}
+        scored = []
+        for tid in candidates:
+            score = sum((1 + math.log(postings[term][tid])) * weight for term, weight in weights.items())
+            scored.append((tid, score))
+        # Best score first, newest task first among equals
+        scored.sort(key=lambda hit: (-hit[1], -hit[0]))
+        return scored
@@ -205,112 +205,211 @@ document.addEventListener('DOMContentLoaded', function() {
         return children.every(child => areAllTasksCompleted(allTasks, child.id));
     }
 
-    // Fetch tasks and group by creation date
-    function loadTasks() {
-        fetch('/tasks')
+    // Tasks we already have, kept up to date with /tasks?since=<version>
+    // and the change events from /tasks/events
+    let knownTasks = new Map();
+    let tasksVersion = null;
+    let tasksLoading = null;
+    let taskEvents = null;
+    let renderPending = false;
+    let timerIntervals = [];
+    
+    function fetchTasks() {
+        const url = tasksVersion === null ? '/tasks' : `/tasks?since=${tasksVersion}`;
+        tasksLoading = fetch(url)
             .then(res => {
                 if (res.redirected) {
                     // If we're redirected, it's likely to the login page
                     window.location.href = res.url;
                     return;
                 }
-                return res.json();
+                return res.json().then(data => {
+                    if (data.error) {
+                        throw new Error(data.error);
+                    }
+                    if (Array.isArray(data) || data.full) {
+                        knownTasks = new Map();
+                    }
+                    (Array.isArray(data) ? data : data.tasks).forEach(task => knownTasks.set(task.id, task));
+                    if (!Array.isArray(data)) {
+                        data.deleted.forEach(id => knownTasks.delete(id));
+                    }
+                    tasksVersion = Array.isArray(data) ? res.headers.get('X-Tasks-Version') : data.version;
+                    return Array.from(knownTasks.values());
+                });
             })
+            .finally(() => {
+                tasksLoading = null;
+            });
+        return tasksLoading;
+    }
+    
+    // Fetch tasks and re-render them
+    function loadTasks() {
+        fetchTasks()
             .then(data => {
                 if (!data) return; // Handle case where we were redirected
-                
-                taskList.innerHTML = '';
-                let groups = {};
-                data.forEach(task => {
-                    let dateStr = task.createdAt ? task.createdAt.split(' ')[0] : 'No Date';
-                    if (!groups[dateStr]) groups[dateStr] = [];
-                    groups[dateStr].push(task);
-                });
-                // Sort dates ascending (oldest first)
-                Object.keys(groups).sort((a, b) => new Date(a) - new Date(b)).forEach(date => {
-                    const rootTasks = groups[date].filter(task => task.level === 0);
-                    const totalTimeEstimate = calculateTotalTimeEstimate(rootTasks);
-                    let dateHeading = document.createElement('h3');
-                    dateHeading.className = 'date-heading';
-                    const dateText = document.createElement('span');
-                    dateText.textContent = formatDate(date);
-                    const totalTime = document.createElement('span');
-                    totalTime.className = 'date-total-time';
-                    totalTime.textContent = totalTimeEstimate;
-                    dateHeading.appendChild(dateText);
-                    dateHeading.appendChild(totalTime);
-                    taskList.appendChild(dateHeading);
-                    // Sort root tasks: incomplete first, then completed
-                    rootTasks.sort((a, b) => {
-                        if (a.completed === b.completed) return 0;
-                        return a.completed ? 1 : -1;
-                    });
-                    rootTasks.forEach(rootTask => {
-                        const taskGroup = document.createElement('div');
-                        taskGroup.className = 'task-group';
-                        taskGroup.dataset.taskId = rootTask.id;
-                        
-                        const allSubtasksComplete = areAllSubtasksCompleted(groups[date], rootTask.id);
-                        const taskElement = createTaskElement(
-                            rootTask.text, 
-                            rootTask.level, 
-                            rootTask.id, 
-                            rootTask.completed, 
-                            rootTask.currentEmotion, 
-                            rootTask.completionEmotion, 
-                            rootTask.totalTimeEstimate, 
-                            rootTask.startTime, 
-                            rootTask.endTime, 
-                            rootTask.timeSpent, 
-                            allSubtasksComplete
-                        );
-                        
-                        // Create container for child tasks
-                        const childTasksContainer = document.createElement('div');
-                        childTasksContainer.className = 'child-tasks';
-                        
-                        taskGroup.appendChild(taskElement);
-                        
-                        // If the main task and all its subtasks are completed, collapse by default
-                        if (allSubtasksComplete && rootTask.completed) {
-                            taskGroup.classList.add('collapsed');
-                            taskElement.classList.add('collapsed');
-                            childTasksContainer.style.display = 'none';
-                            // We'll use CSS to control the display of emotions properly
-                        }
-                        
-                        // Add collapse toggle arrow to the main task
-                        const collapseToggle = document.createElement('span');
-                        collapseToggle.className = 'collapse-toggle';
-                        collapseToggle.addEventListener('click', function(e) {
-                            e.stopPropagation();
-                            // Toggle collapsed class on both the container and the main task element
-                            taskGroup.classList.toggle('collapsed');
-                            taskElement.classList.toggle('collapsed');
-                            // Manually hide/show the child tasks container
-                            if (taskGroup.classList.contains('collapsed')) {
-                                childTasksContainer.style.display = 'none';
-                                // We'll use CSS to control the display of emotions properly
-                            } else {
-                                childTasksContainer.style.display = 'block';
-                                // We'll use CSS to control the display of emotions properly
-                            }
-                        });
-                        taskElement.querySelector('.task-text-container').appendChild(collapseToggle);
-                        
-                        addChildTasks(groups[date], rootTask.id, 1, childTasksContainer);
-                        taskGroup.appendChild(childTasksContainer);
-                        taskList.appendChild(taskGroup);
-                    });
-                });
-                if (Object.keys(groups).length > 0) {
-                    taskList.scrollTop = taskList.scrollHeight;
-                }
+                renderTasks(data);
             })
             .catch(err => {
                 console.error('Error loading tasks:', err);
             });
     }
+    
+    // Only needed when the change stream isn't connected; otherwise our own
+    // changes come back as events like everyone else's
+    function refreshTasks() {
+        if (!taskEvents || taskEvents.readyState !== EventSource.OPEN) {
+            loadTasks();
+        }
+    }
+    
+    function isEditingTask() {
+        const active = document.activeElement;
+        return active && active.isContentEditable && taskList.contains(active);
+    }
+    
+    // Re-render from knownTasks, but not under the cursor of someone typing
+    function scheduleRender() {
+        if (isEditingTask()) {
+            renderPending = true;
+            return;
+        }
+        renderPending = false;
+        // Stay where the user was rather than jumping to the newest tasks
+        const scrollTop = taskList.scrollTop;
+        renderTasks(Array.from(knownTasks.values()));
+        taskList.scrollTop = scrollTop;
+    }
+    
+    taskList.addEventListener('focusout', function() {
+        // Wait for focus to land, in case it moved to another task's text
+        setTimeout(() => {
+            if (renderPending && !isEditingTask()) {
+                scheduleRender();
+            }
+        }, 0);
+    });
+    
+    function applyChange(change) {
+        change.tasks.forEach(task => knownTasks.set(task.id, task));
+        change.deleted.forEach(id => knownTasks.delete(id));
+        // Changes relayed from another server process don't carry a version we can use
+        if (change.version !== null) {
+            tasksVersion = change.version;
+        }
+        scheduleRender();
+    }
+    
+    // Server-sent task changes, from this tab and every other one
+    function watchTasks() {
+        if (!window.EventSource) return;
+        taskEvents = new EventSource('/tasks/events');
+        taskEvents.addEventListener('hello', e => {
+            const data = JSON.parse(e.data);
+            // Catch up on anything that changed before the stream connected
+            (tasksLoading || Promise.resolve()).then(() => {
+                if (String(data.version) !== String(tasksVersion)) {
+                    loadTasks();
+                }
+            });
+        });
+        taskEvents.addEventListener('change', e => applyChange(JSON.parse(e.data)));
+        taskEvents.addEventListener('resync', () => loadTasks());
+    }
+    
+    // Group tasks by creation date and draw them
+    function renderTasks(data) {
+        timerIntervals.forEach(clearInterval);
+        timerIntervals = [];
+        taskList.innerHTML = '';
+        let groups = {};
+        data.forEach(task => {
+            let dateStr = task.createdAt ? task.createdAt.split(' ')[0] : 'No Date';
+            if (!groups[dateStr]) groups[dateStr] = [];
+            groups[dateStr].push(task);
+        });
+        // Sort dates ascending (oldest first)
+        Object.keys(groups).sort((a, b) => new Date(a) - new Date(b)).forEach(date => {
+            const rootTasks = groups[date].filter(task => task.level === 0);
+            const totalTimeEstimate = calculateTotalTimeEstimate(rootTasks);
+            let dateHeading = document.createElement('h3');
+            dateHeading.className = 'date-heading';
+            const dateText = document.createElement('span');
+            dateText.textContent = formatDate(date);
+            const totalTime = document.createElement('span');
+            totalTime.className = 'date-total-time';
+            totalTime.textContent = totalTimeEstimate;
+            dateHeading.appendChild(dateText);
+            dateHeading.appendChild(totalTime);
+            taskList.appendChild(dateHeading);
+            // Sort root tasks: incomplete first, then completed
+            rootTasks.sort((a, b) => {
+                if (a.completed === b.completed) return 0;
+                return a.completed ? 1 : -1;
+            });
+            rootTasks.forEach(rootTask => {
+                const taskGroup = document.createElement('div');
+                taskGroup.className = 'task-group';
+                taskGroup.dataset.taskId = rootTask.id;
+                
+                const allSubtasksComplete = areAllSubtasksCompleted(groups[date], rootTask.id);
+                const taskElement = createTaskElement(
+                    rootTask.text, 
+                    rootTask.level, 
+                    rootTask.id, 
+                    rootTask.completed, 
+                    rootTask.currentEmotion, 
+                    rootTask.completionEmotion, 
+                    rootTask.totalTimeEstimate, 
+                    rootTask.startTime, 
+                    rootTask.endTime, 
+                    rootTask.timeSpent, 
+                    allSubtasksComplete
+                );
+                
+                // Create container for child tasks
+                const childTasksContainer = document.createElement('div');
+                childTasksContainer.className = 'child-tasks';
+                
+                taskGroup.appendChild(taskElement);
+                
+                // If the main task and all its subtasks are completed, collapse by default
+                if (allSubtasksComplete && rootTask.completed) {
+                    taskGroup.classList.add('collapsed');
+                    taskElement.classList.add('collapsed');
+                    childTasksContainer.style.display = 'none';
+                    // We'll use CSS to control the display of emotions properly
+                }
+                
+                // Add collapse toggle arrow to the main task
+                const collapseToggle = document.createElement('span');
+                collapseToggle.className = 'collapse-toggle';
+                collapseToggle.addEventListener('click', function(e) {
+                    e.stopPropagation();
+                    // Toggle collapsed class on both the container and the main task element
+                    taskGroup.classList.toggle('collapsed');
+                    taskElement.classList.toggle('collapsed');
+                    // Manually hide/show the child tasks container
+                    if (taskGroup.classList.contains('collapsed')) {
+                        childTasksContainer.style.display = 'none';
+                        // We'll use CSS to control the display of emotions properly
+                    } else {
+                        childTasksContainer.style.display = 'block';
+                        // We'll use CSS to control the display of emotions properly
+                    }
+                });
+                taskElement.querySelector('.task-text-container').appendChild(collapseToggle);
+                
+                addChildTasks(groups[date], rootTask.id, 1, childTasksContainer);
+                taskGroup.appendChild(childTasksContainer);
+                taskList.appendChild(taskGroup);
+            });
+        });
+        if (Object.keys(groups).length > 0) {
+            taskList.scrollTop = taskList.scrollHeight;
+        }
+    }
 
     // Format date to be more readable
     function formatDate(dateStr) {
@@ -442,7 +541,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     if (resp.success) {
                         circle.classList.toggle('completed');
                         element.classList.toggle('task-completed');
-                        loadTasks();
+                        refreshTasks();
                     }
                 })
                 .catch(err => console.error(err));
@@ -533,6 +632,22 @@ document.addEventListener('DOMContentLoaded', function() {
             let startTimestamp = null;
             let accumulatedSeconds = timeSpent ? parseTime(timeSpent) : 0;
             
+            function runTimer(since) {
+                startTimestamp = since;
+                timerInterval = setInterval(() => {
+                    let elapsed = Math.floor((Date.now() - startTimestamp) / 1000);
+                    timerDisplay.textContent = formatTime(accumulatedSeconds + elapsed);
+                }, 1000);
+                timerIntervals.push(timerInterval);
+                startBtn.disabled = true;
+                stopBtn.disabled = false;
+            }
+            
+            // Started earlier or in another tab and not stopped yet
+            if (startTime && !endTime) {
+                runTimer(new Date(startTime.replace(' ', 'T')).getTime());
+            }
+            
             startBtn.addEventListener('click', function(e) {
                 e.stopPropagation();
                 fetch(`/tasks/${taskId}/stopwatch`, {
@@ -542,13 +657,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 }).then(response => response.json())
                   .then(data => {
                       if (data.success) {
-                          startTimestamp = Date.now();
-                          timerInterval = setInterval(() => {
-                              let elapsed = Math.floor((Date.now() - startTimestamp) / 1000);
-                              timerDisplay.textContent = formatTime(accumulatedSeconds + elapsed);
-                          }, 1000);
-                          startBtn.disabled = true;
-                          stopBtn.disabled = false;
+                          runTimer(Date.now());
                       }
                   }).catch(err => console.error(err));
             });
@@ -617,7 +726,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         .then(r => r.json())
                         .then(resp => {
                             if (resp.success) {
-                                loadTasks();
+                                refreshTasks();
                             }
                         })
                         .catch(err => console.error(err));
@@ -662,6 +771,118 @@ document.addEventListener('DOMContentLoaded', function() {
         return emotionBox;
     }
     
+    // Poll a generation job until it is done or failed
+    function waitForGenerationJob(jobId) {
+        return fetch(`/generate/${jobId}`)
+            .then(res => res.json())
+            .then(job => {
+                if (job.status === 'done' || job.status === 'error' || job.error) {
+                    return job;
+                }
+                return new Promise(resolve => setTimeout(resolve, 1000))
+                    .then(() => waitForGenerationJob(jobId));
+            });
+    }
+    
+    // Show the streamed title/subtasks at the top of the list until the real tasks load
+    function previewItem(text, level) {
+        const item = document.createElement('div');
+        item.className = 'task-item';
+        if (level > 0) {
+            item.classList.add(`level-${level}`);
+            item.style.paddingLeft = `${level * 30}px`;
+        }
+        const textSpan = document.createElement('span');
+        textSpan.className = 'task-text';
+        textSpan.textContent = text;
+        item.appendChild(textSpan);
+        return item;
+    }
+    
+    // Generate via /generate/stream, rendering subtasks as the model writes them.
+    // Resolves with the final tree, or null if streaming isn't available.
+    function streamGeneration(context) {
+        if (!window.ReadableStream || !window.TextDecoder) {
+            return Promise.resolve(null);
+        }
+        return fetch('/generate/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ context })
+        }).then(res => {
+            if (res.redirected) {
+                window.location.href = res.url;
+                return;
+            }
+            if (!res.ok || !res.body) {
+                return res.json();
+            }
+            const preview = document.createElement('div');
+            preview.className = 'task-group';
+            taskList.prepend(preview);
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let result = null;
+            
+            function handleEvent(raw) {
+                let event = 'message';
+                let data = '';
+                raw.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) event = line.slice(7);
+                    if (line.startsWith('data: ')) data += line.slice(6);
+                });
+                if (!data) return;
+                const payload = JSON.parse(data);
+                if (event === 'title') {
+                    preview.appendChild(previewItem(payload, 0));
+                } else if (event === 'subtask') {
+                    preview.appendChild(previewItem(payload.title, 1));
+                    (payload.steps || []).forEach(step => preview.appendChild(previewItem(step, 2)));
+                } else if (event === 'done' || event === 'error') {
+                    result = payload;
+                }
+            }
+            
+            function pump() {
+                return reader.read().then(({ done, value }) => {
+                    if (done) {
+                        return result || { error: 'Generation was interrupted' };
+                    }
+                    buffer += decoder.decode(value, { stream: true });
+                    const events = buffer.split('\n\n');
+                    buffer = events.pop();
+                    events.forEach(handleEvent);
+                    return pump();
+                });
+            }
+            return pump();
+        });
+    }
+    
+    // Queue a generation job and wait for it (used when streaming isn't supported)
+    function queueGeneration(context) {
+        return fetch('/generate', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ context })
+        })
+        .then(res => {
+            if (res.redirected) {
+                window.location.href = res.url;
+                return;
+            }
+            return res.json();
+        })
+        .then(data => {
+            if (!data) return; // Handle case where we were redirected
+            // Generation runs in the background; wait for the job to finish
+            return data.error ? data : waitForGenerationJob(data.id);
+        });
+    }
+    
     // Add event listener for the generate button
     if (generateBtn) {
         generateBtn.addEventListener('click', function() {
@@ -674,28 +895,16 @@ document.addEventListener('DOMContentLoaded', function() {
             generateBtn.disabled = true;
             generateBtn.textContent = 'Generating...';
             
-            fetch('/generate', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ context })
-            })
-            .then(res => {
-                if (res.redirected) {
-                    window.location.href = res.url;
-                    return;
-                }
-                return res.json();
-            })
+            streamGeneration(context)
+            .then(data => data === null ? queueGeneration(context) : data)
             .then(data => {
-                if (!data) return; // Handle case where we were redirected
+                if (!data) return;
                 
                 if (data.error) {
                     alert('Error: ' + data.error);
                 } else {
                     taskContext.value = '';
-                    loadTasks();
+                    refreshTasks();
                 }
                 
                 generateBtn.disabled = false;
@@ -822,7 +1031,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         if (timerDisplay) {
                             timerDisplay.classList.remove('running');
                             // Reload tasks to get updated time
-                            loadTasks();
+                            refreshTasks();
                         }
                     } else if (action === 'reset') {
                         if (timerDisplay) {
@@ -908,4 +1117,5 @@ document.addEventListener('DOMContentLoaded', function() {
     });
     
     loadTasks();
+    watchTasks();
 });
@@ -0,0 +1,661 @@
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from task_model import TASK_FIELDS, Task
+
+try:
+    import fcntl
+except ImportError:  # Windows: the sequence file is only locked within this process
+    fcntl = None
+
+# we will store and read from tasks.csv
+DATA_FILE = 'tasks.csv'
+USERS_FILE = 'users.csv'
+
+# Task mutations are appended to the journal and folded back into DATA_FILE
+# once it grows past JOURNAL_COMPACT_THRESHOLD records.
+# Set TASK_STORAGE_MODE=csv to rewrite DATA_FILE on every change instead.
+JOURNAL_FILE = 'tasks.journal'
+STORAGE_MODE = os.getenv('TASK_STORAGE_MODE', 'journal')
+JOURNAL_COMPACT_THRESHOLD = int(os.getenv('JOURNAL_COMPACT_THRESHOLD', '500'))
+journal_entries = 0
+
+# TASK_LAYOUT=sharded keeps one CSV per user under SHARD_DIR instead of one tasks.csv
+TASK_LAYOUT = os.getenv('TASK_LAYOUT', 'single')
+SHARD_DIR = os.getenv('SHARD_DIR', os.path.join('data', 'tasks'))
+# Replaced on every shard write, so its stamp changes whenever any shard does
+SHARD_VERSION_FILE = 'VERSION'
+
+# STORAGE_BACKEND=sqlite keeps tasks and users in SQLITE_PATH instead of the CSV files
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'csv')
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'tasks.db')
+
+# Next free task id, shared by every process that writes tasks.csv
+SEQUENCE_FILE = 'tasks.seq'
+sequence_lock = threading.Lock()
+
+
+class FileLock:
+    """A lock shared by this process's threads and, through flock on path, by other processes.
+
+    Reentrant within a thread; a nested hold keeps the mode of the outer one.
+    shared=True lets other processes' shared holders in at the same time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    @contextmanager
+    def hold(self, shared=False):
+        with self._lock:
+            if self._depth == 0:
+                self._file = open(self.path, 'a')
+                if fcntl:
+                    fcntl.flock(self._file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    # Closing the file releases the flock
+                    self._file.close()
+                    self._file = None
+
+# Held exclusively to change DATA_FILE or the journal and shared to read them,
+# so no worker appends or reads between a compaction's snapshot and truncate
+journal_lock = FileLock(JOURNAL_FILE + '.lock')
+
+#############################
+# 1) CSV Helper Functions   #
+#############################
+
+def load_tasks_from_csv(username=None):
+    if TASK_LAYOUT == 'sharded':
+        return load_task_shards(username)
+    with journal_lock.hold(shared=True):
+        tasks = read_tasks_csv(DATA_FILE, username)
+        if STORAGE_MODE == 'journal':
+            replay_journal(tasks, username)
+    return tasks
+
+def read_tasks_csv(path, username=None):
+    tasks = []
+    if not os.path.exists(path):
+        return tasks
+    with open(path, 'r', newline='', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            # Only load tasks for the current user if username is provided
+            if username and row.get('username') != username:
+                continue
+            try:
+                tasks.append(Task.from_row(row))
+            except Exception as e:
+                print(f"Error loading task from CSV: {e}. Skipping row: {row}")
+                continue
+    return tasks
+
+def write_tasks_to_csv(tasks, path=DATA_FILE):
+    # Write a temp file and rename it over the old one, so readers never see half a file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(TASK_FIELDS)
+        writer.writerows(task.to_row() for task in tasks)
+    os.replace(tmp_path, path)
+
+#############################
+# 2) Task journal           #
+#############################
+
+def apply_task_records(tasks, records, username=None):
+    """Apply put/delete records to a list of tasks, in order."""
+    # Position of the first task for each (username, id), like the routes' lookups
+    positions = {}
+    for i, task in enumerate(tasks):
+        positions.setdefault((task.username, task.id), i)
+    deleted = set()
+    for record in records:
+        if record['op'] == 'put':
+            task = record['task']
+            if username and task.username != username:
+                continue
+            key = (task.username, task.id)
+            deleted.discard(key)
+            if key in positions:
+                tasks[positions[key]] = task
+            else:
+                positions[key] = len(tasks)
+                tasks.append(task)
+        elif record['op'] == 'delete':
+            if username and record['username'] != username:
+                continue
+            for task_id in record['ids']:
+                deleted.add((record['username'], task_id))
+    if deleted:
+        tasks[:] = [t for t in tasks if (t.username, t.id) not in deleted]
+    return tasks
+
+def read_journal():
+    records = []
+    if not os.path.exists(JOURNAL_FILE):
+        return records
+    with open(JOURNAL_FILE, 'r', encoding='utf-8') as journal:
+        for line in journal:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(decode_record(json.loads(line)))
+            except (ValueError, KeyError, AttributeError):
+                # A torn last line from a crash mid-append; everything before it is intact
+                print(f"Skipping unreadable journal record: {line[:80]}")
+    return records
+
+def replay_journal(tasks, username=None):
+    """Apply the journal records on top of tasks loaded from the snapshot."""
+    global journal_entries
+    records = read_journal()
+    apply_task_records(tasks, records, username)
+    if username is None:
+        journal_entries = len(records)
+    return tasks
+
+def append_journal(records):
+    """Append mutation records to the journal, compacting it when it gets too long."""
+    global journal_entries
+    with journal_lock.hold():
+        with open(JOURNAL_FILE, 'a', encoding='utf-8') as journal:
+            journal.write(''.join(json.dumps(encode_record(r)) + '\n' for r in records))
+        journal_entries += len(records)
+        if journal_entries >= JOURNAL_COMPACT_THRESHOLD:
+            compact_journal()
+
+def compact_journal():
+    """Fold the journal into a fresh DATA_FILE snapshot."""
+    global journal_entries
+    with journal_lock.hold():
+        write_tasks_to_csv(load_tasks_from_csv())
+        # Replaying records already in the snapshot is harmless, so a crash here loses nothing
+        open(JOURNAL_FILE, 'w').close()
+        journal_entries = 0
+
+def encode_record(record):
+    if record['op'] == 'put':
+        return dict(record, task=record['task'].to_json())
+    return record
+
+def decode_record(record):
+    if record['op'] == 'put':
+        record['task'] = Task.from_json(record['task'])
+    return record
+
+def journal_put(tasks):
+    return [{'op': 'put', 'task': task} for task in tasks]
+
+def journal_delete(username, task_ids):
+    return [{'op': 'delete', 'username': username, 'ids': sorted(task_ids)}]
+
+#############################
+# 3) User CSV Functions     #
+#############################
+
+def load_users_from_csv():
+    users = {}
+    if not os.path.exists(USERS_FILE):
+        print(f"Creating new users file at {USERS_FILE}")
+        with open(USERS_FILE, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=['username', 'password', 'api_key'])
+            writer.writeheader()
+        return users
+    
+    try:
+        print(f"Loading users from {USERS_FILE}")
+        with open(USERS_FILE, 'r', newline='', encoding='utf-8') as csvfile:
+            reader = csv.DictReader(csvfile)
+            for row in reader:
+                users[row.get('username', '')] = {
+                    'password': row.get('password', ''),
+                    'api_key': row.get('api_key', '')
+                }
+        print(f"Loaded {len(users)} users")
+    except Exception as e:
+        print(f"Error loading users: {e}")
+        # If there's an error with the CSV file, recreate it
+        print("Recreating users.csv file with correct headers")
+        with open(USERS_FILE, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=['username', 'password', 'api_key'])
+            writer.writeheader()
+    return users
+
+def add_user_to_csv(username, password):
+    users = load_users_from_csv()
+    if username in users:
+        return False
+    
+    with open(USERS_FILE, 'a', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=['username', 'password', 'api_key'])
+        writer.writerow({'username': username, 'password': password, 'api_key': ''})
+    return True
+
+def update_user_api_key(username, api_key):
+    users = load_users_from_csv()
+    if username not in users:
+        return False
+    
+    # Read all rows
+    rows = []
+    with open(USERS_FILE, 'r', newline='', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile)
+        fieldnames = reader.fieldnames
+        for row in reader:
+            if row['username'] == username:
+                row['api_key'] = api_key
+            rows.append(row)
+    
+    # Write back all rows
+    with open(USERS_FILE, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    return True
+
+#############################
+# 4) Storage backends       #
+#############################
+
+class Storage:
+    """Where tasks and users live. The app only talks to this interface."""
+
+    # Whether load_tasks(username) reads only that user's tasks; if not, it
+    # costs as much as loading everyone, so callers should load everyone once
+    per_user_loads = True
+
+    def load_tasks(self, username=None):
+        raise NotImplementedError
+
+    def save_tasks(self, tasks):
+        """Insert or update the given tasks, matched on (username, id)."""
+        self.apply_changes(tasks, [])
+
+    def delete_tasks(self, username, task_ids):
+        self.apply_changes([], [(username, task_ids)])
+
+    def apply_changes(self, tasks, deletions):
+        """Save tasks, then delete each (username, ids) in deletions, as one write."""
+        records = journal_put(tasks)
+        for username, task_ids in deletions:
+            records.extend(journal_delete(username, task_ids))
+        self.apply_records(records)
+
+    def apply_records(self, records):
+        """Apply journal-style put/delete records, in order, as one write.
+
+        Returns the stamp() from just before and just after the write, taken
+        under a lock that every process's writes also take, so callers can
+        tell whether anyone else wrote since they last looked.
+        """
+        raise NotImplementedError
+
+    def stamp(self):
+        """A value that changes whenever any process writes tasks."""
+        raise NotImplementedError
+
+    def allocate_task_ids(self, count, floor=1):
+        """Reserve count consecutive task ids, none below floor. Returns the first.
+
+        The sequence is persistent and shared by every process using the
+        same store, so ids are never handed out twice, even after deletes.
+        """
+        raise NotImplementedError
+
+    def load_users(self):
+        raise NotImplementedError
+
+    def users_stamp(self):
+        """Like stamp(), for the user table."""
+        raise NotImplementedError
+
+    def add_user(self, username, password):
+        """Create a user. Returns False if the username is taken."""
+        raise NotImplementedError
+
+    def update_user_api_key(self, username, api_key):
+        """Returns False if the user doesn't exist."""
+        raise NotImplementedError
+
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    # Rewrites replace the file, so the inode changes even within one mtime tick
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class CsvStorage(Storage):
+    """tasks.csv (plus the journal) and users.csv."""
+
+    per_user_loads = False
+
+    def load_tasks(self, username=None):
+        return load_tasks_from_csv(username)
+
+    def apply_records(self, records):
+        with journal_lock.hold():
+            before = self.stamp()
+            if not records:
+                return before, before
+            if STORAGE_MODE == 'journal':
+                append_journal(records)
+            else:
+                tasks = apply_task_records(load_tasks_from_csv(), records)
+                write_tasks_to_csv(tasks)
+            return before, self.stamp()
+
+    def stamp(self):
+        """Inode, mtime and size of the task files."""
+        return tuple(file_stamp(path) for path in (DATA_FILE, JOURNAL_FILE))
+
+    def allocate_task_ids(self, count, floor=1):
+        return allocate_ids_from_file(SEQUENCE_FILE, count, floor)
+
+    def load_users(self):
+        return load_users_from_csv()
+
+    def users_stamp(self):
+        return file_stamp(USERS_FILE)
+
+    def add_user(self, username, password):
+        return add_user_to_csv(username, password)
+
+    def update_user_api_key(self, username, api_key):
+        return update_user_api_key(username, api_key)
+
+
+class ShardedCsvStorage(CsvStorage):
+    """One CSV file per user under SHARD_DIR; users.csv as before.
+
+    A write only reads and rewrites the shards of the users it touches.
+    Writes hold one lock across processes, so the stamp taken before a
+    write can't miss another process's write landing in between.
+    """
+
+    per_user_loads = True
+
+    def __init__(self, directory=SHARD_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._write_lock = FileLock(os.path.join(directory, SHARD_VERSION_FILE + '.lock'))
+
+    def load_tasks(self, username=None):
+        return load_task_shards(username, self.directory)
+
+    def apply_records(self, records):
+        by_user = {}
+        for record in records:
+            username = record['task'].username if record['op'] == 'put' else record['username']
+            by_user.setdefault(username, []).append(record)
+        with self._write_lock.hold():
+            before = self.stamp()
+            for username, user_records in by_user.items():
+                path = shard_path(username, self.directory)
+                tasks = apply_task_records(read_tasks_csv(path), user_records)
+                write_tasks_to_csv(tasks, path)
+            if by_user:
+                bump_shard_version(self.directory)
+            return before, self.stamp()
+
+    def stamp(self):
+        return file_stamp(os.path.join(self.directory, SHARD_VERSION_FILE))
+
+    def allocate_task_ids(self, count, floor=1):
+        return allocate_ids_from_file(os.path.join(self.directory, SEQUENCE_FILE), count, floor)
+
+
+def allocate_ids_from_file(path, count, floor=1):
+    """Reserve count ids from the sequence file at path, under an exclusive lock.
+
+    A missing or unreadable file starts again from floor, which callers set
+    just above the highest id they have loaded.
+    """
+    with sequence_lock, open(path + '.lock', 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with open(path, 'r') as f:
+                next_id = int(f.read().strip())
+        except (OSError, ValueError):
+            next_id = 0
+        start = max(next_id, floor)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(str(start + count))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        # Closing lock_file releases the flock
+    return start
+
+def shard_path(username, directory=SHARD_DIR):
+    # Percent-encode so any username is a safe, unique file name
+    return os.path.join(directory, 'u-' + quote(username, safe='') + '.csv')
+
+def load_task_shards(username=None, directory=SHARD_DIR):
+    if username:
+        return read_tasks_csv(shard_path(username, directory))
+    tasks = []
+    if not os.path.isdir(directory):
+        return tasks
+    for name in sorted(os.listdir(directory)):
+        if name.startswith('u-') and name.endswith('.csv'):
+            tasks.extend(read_tasks_csv(os.path.join(directory, name)))
+    return tasks
+
+def bump_shard_version(directory=SHARD_DIR):
+    path = os.path.join(directory, SHARD_VERSION_FILE)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(str(time.time_ns()))
+    os.replace(tmp_path, path)
+
+def split_tasks_into_shards(directory=SHARD_DIR):
+    """One-shot split of tasks.csv (with its journal) into per-user shards."""
+    with journal_lock.hold(shared=True):
+        tasks = read_tasks_csv(DATA_FILE)
+        replay_journal(tasks)
+    by_user = {}
+    for task in tasks:
+        by_user.setdefault(task.username, []).append(task)
+    os.makedirs(directory, exist_ok=True)
+    for username, user_tasks in by_user.items():
+        write_tasks_to_csv(user_tasks, shard_path(username, directory))
+    # Shards are loaded one user at a time, so start the id sequence above every user's ids
+    allocate_ids_from_file(os.path.join(directory, SEQUENCE_FILE), 0, max((t.id for t in tasks), default=0) + 1)
+    bump_shard_version(directory)
+    print(f"Split {len(tasks)} tasks into {len(by_user)} shards in {directory}")
+    return ShardedCsvStorage(directory)
+
+
+TASK_COLUMNS = ', '.join(TASK_FIELDS)
+TASK_PLACEHOLDERS = ', '.join('?' * len(TASK_FIELDS))
+UPSERT_TASK_SQL = (
+    f'INSERT INTO tasks ({TASK_COLUMNS}) VALUES ({TASK_PLACEHOLDERS}) '
+    'ON CONFLICT (username, id) DO UPDATE SET '
+    + ', '.join(f'{f} = excluded.{f}' for f in TASK_FIELDS if f not in ('id', 'username'))
+)
+# OR IGNORE keeps the first of any rows sharing a (username, id), as the app does
+IMPORT_TASK_SQL = f'INSERT OR IGNORE INTO tasks ({TASK_COLUMNS}) VALUES ({TASK_PLACEHOLDERS})'
+
+class SqliteStorage(Storage):
+    """SQLite in WAL mode, safe to share between several gunicorn workers.
+
+    Every task write bumps meta.version in the same transaction, which is
+    what stamp() returns, so workers can tell when their in-memory copy is
+    stale. User writes bump meta.users_version instead.
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER NOT NULL,
+                parent_id INTEGER NOT NULL DEFAULT 0,
+                text TEXT NOT NULL DEFAULT '',
+                level INTEGER NOT NULL DEFAULT 0,
+                completed INTEGER NOT NULL DEFAULT 0,
+                currentEmotion TEXT NOT NULL DEFAULT '',
+                completionEmotion TEXT NOT NULL DEFAULT '',
+                totalTimeEstimate TEXT NOT NULL DEFAULT '',
+                createdAt TEXT NOT NULL DEFAULT '',
+                startTime TEXT NOT NULL DEFAULT '',
+                endTime TEXT NOT NULL DEFAULT '',
+                timeSpent TEXT NOT NULL DEFAULT '',
+                username TEXT NOT NULL DEFAULT ''
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS tasks_username_id ON tasks (username, id);
+            CREATE INDEX IF NOT EXISTS tasks_username_parent ON tasks (username, parent_id);
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                password TEXT NOT NULL,
+                api_key TEXT NOT NULL DEFAULT ''
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0), ('users_version', 0);
+            INSERT OR IGNORE INTO meta (key, value) SELECT 'next_task_id', COALESCE(MAX(id), 0) + 1 FROM tasks;
+        """)
+
+    def _conn(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, statements, version_key='version'):
+        """Run (sql, params) pairs in one write transaction and bump the version.
+
+        Returns the version from before the write and the statements' cursors.
+        """
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            before = conn.execute('SELECT value FROM meta WHERE key = ?', (version_key,)).fetchone()[0]
+            results = [conn.execute(sql, params) for sql, params in statements]
+            conn.execute('UPDATE meta SET value = value + 1 WHERE key = ?', (version_key,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return before, results
+
+    def load_tasks(self, username=None):
+        if username:
+            rows = self._conn().execute('SELECT * FROM tasks WHERE username = ? ORDER BY rowid', (username,))
+        else:
+            rows = self._conn().execute('SELECT * FROM tasks ORDER BY rowid')
+        return [row_to_task(row) for row in rows]
+
+    def apply_records(self, records):
+        statements = []
+        for record in records:
+            if record['op'] == 'put':
+                statements.append((UPSERT_TASK_SQL, task_to_row(record['task'])))
+            else:
+                statements.extend(
+                    ('DELETE FROM tasks WHERE username = ? AND id = ?', (record['username'], task_id))
+                    for task_id in record['ids']
+                )
+        if not statements:
+            stamp = self.stamp()
+            return stamp, stamp
+        before, _ = self._transaction(statements)
+        return before, before + 1
+
+    def stamp(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def allocate_task_ids(self, count, floor=1):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            next_id = conn.execute("SELECT value FROM meta WHERE key = 'next_task_id'").fetchone()[0]
+            start = max(next_id, floor)
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'next_task_id'", (start + count,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return start
+
+    def users_stamp(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'users_version'").fetchone()[0]
+
+    def load_users(self):
+        rows = self._conn().execute('SELECT username, password, api_key FROM users')
+        return {row['username']: {'password': row['password'], 'api_key': row['api_key']} for row in rows}
+
+    def add_user(self, username, password):
+        _, (cursor,) = self._transaction([
+            ("INSERT OR IGNORE INTO users (username, password, api_key) VALUES (?, ?, '')", (username, password))
+        ], version_key='users_version')
+        return cursor.rowcount == 1
+
+    def update_user_api_key(self, username, api_key):
+        _, (cursor,) = self._transaction([
+            ('UPDATE users SET api_key = ? WHERE username = ?', (api_key, username))
+        ], version_key='users_version')
+        return cursor.rowcount == 1
+
+
+def task_to_row(task):
+    return list(task.to_json().values())
+
+def row_to_task(row):
+    return Task.from_json(dict(row))
+
+def migrate_csv_to_sqlite(db_path=SQLITE_PATH):
+    """One-shot copy of tasks.csv (with its journal) and users.csv into SQLite."""
+    target = SqliteStorage(db_path)
+    tasks = load_tasks_from_csv()
+    users = load_users_from_csv()
+    conn = target._conn()
+    conn.execute('BEGIN IMMEDIATE')
+    conn.executemany(IMPORT_TASK_SQL, [task_to_row(task) for task in tasks])
+    conn.executemany('INSERT OR IGNORE INTO users (username, password, api_key) VALUES (?, ?, ?)',
+                     [(name, user['password'], user['api_key']) for name, user in users.items()])
+    conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+    conn.execute("UPDATE meta SET value = MAX(value, (SELECT COALESCE(MAX(id), 0) + 1 FROM tasks)) "
+                 "WHERE key = 'next_task_id'")
+    conn.execute('COMMIT')
+    count = conn.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+    print(f"Migrated {count} tasks and {len(users)} users into {db_path}")
+    return target
+
+def make_storage():
+    if STORAGE_BACKEND == 'sqlite':
+        if not os.path.exists(SQLITE_PATH) and os.path.exists(DATA_FILE):
+            return migrate_csv_to_sqlite(SQLITE_PATH)
+        return SqliteStorage(SQLITE_PATH)
+    if TASK_LAYOUT == 'sharded':
+        if not os.path.isdir(SHARD_DIR) and os.path.exists(DATA_FILE):
+            return split_tasks_into_shards(SHARD_DIR)
+        return ShardedCsvStorage(SHARD_DIR)
+    return CsvStorage()
@@ -0,0 +1,173 @@
+import json
+import sys
+import time
+from functools import lru_cache
+
+TASK_FIELDS = ['id', 'parent_id', 'text', 'level', 'completed', 'currentEmotion', 'completionEmotion', 'totalTimeEstimate', 'createdAt', 'startTime', 'endTime', 'timeSpent', 'username']
+
+# How timestamps look in the CSV files, the journal and the API (local time)
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+@lru_cache(maxsize=4096)
+def parse_time(text):
+    """TIME_FORMAT string to epoch seconds; None if empty or unreadable."""
+    if not text:
+        return None
+    try:
+        return int(time.mktime(time.strptime(text, TIME_FORMAT)))
+    except (ValueError, OverflowError):
+        return None
+
+@lru_cache(maxsize=4096)
+def format_time(seconds):
+    if seconds is None:
+        return ''
+    return time.strftime(TIME_FORMAT, time.localtime(seconds))
+
+def parse_duration(text):
+    """'HH:MM:SS' to seconds; None if empty or unreadable."""
+    if not text:
+        return None
+    parts = text.split(':')
+    if len(parts) != 3:
+        return None
+    try:
+        hours, minutes, seconds = (int(part) for part in parts)
+    except ValueError:
+        return None
+    return hours * 3600 + minutes * 60 + seconds
+
+def format_duration(seconds):
+    if seconds is None:
+        return ''
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def intern_text(value):
+    """Share one copy of strings that repeat across many tasks, like emotions."""
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        # e.g. an emotion list sent straight from the browser
+        value = json.dumps(value)
+    return sys.intern(value)
+
+def to_bool(value):
+    """A JSON boolean, or a 'True'/'false' string like the CSV columns hold."""
+    if isinstance(value, str):
+        return value.lower() == 'true'
+    return bool(value)
+
+def to_text(value):
+    """Task text as a string, whatever JSON type it arrived as."""
+    if value is None:
+        return ''
+    return value if isinstance(value, str) else str(value)
+
+def to_int(value):
+    if isinstance(value, int):
+        return value
+    value = (value or '').strip()
+    return int(value) if value else 0
+
+
+class Task:
+    """One task, with a slot per field instead of a 13-key dict.
+
+    Attributes are named after TASK_FIELDS. Timestamps are epoch seconds and
+    timeSpent is a number of seconds, None when unset; usernames, emotions
+    and estimates are interned. The files and the API keep the old string
+    formats: the from_/to_ methods convert at those edges.
+    """
+
+    __slots__ = tuple(TASK_FIELDS)
+
+    def __init__(self, id, parent_id=0, text='', level=0, completed=False, currentEmotion='',
+                 completionEmotion='', totalTimeEstimate='', createdAt=None, startTime=None,
+                 endTime=None, timeSpent=None, username=''):
+        self.id = id
+        self.parent_id = parent_id
+        self.text = text
+        self.level = level
+        self.completed = completed
+        self.currentEmotion = intern_text(currentEmotion)
+        self.completionEmotion = intern_text(completionEmotion)
+        self.totalTimeEstimate = intern_text(totalTimeEstimate)
+        self.createdAt = createdAt
+        self.startTime = startTime
+        self.endTime = endTime
+        self.timeSpent = timeSpent
+        self.username = sys.intern(username)
+
+    def __repr__(self):
+        return f"Task(id={self.id!r}, username={self.username!r}, text={self.text!r})"
+
+    def copy(self):
+        clone = Task.__new__(Task)
+        for field in TASK_FIELDS:
+            setattr(clone, field, getattr(self, field))
+        return clone
+
+    @classmethod
+    def from_row(cls, row):
+        """From a csv.DictReader row, where every value is a string."""
+        return cls(
+            to_int(row.get('id')),
+            to_int(row.get('parent_id')),
+            row.get('text', ''),
+            to_int(row.get('level')),
+            (row.get('completed') or 'False').lower() == 'true',
+            row.get('currentEmotion', ''),
+            row.get('completionEmotion', ''),
+            row.get('totalTimeEstimate', ''),
+            parse_time(row.get('createdAt')),
+            parse_time(row.get('startTime')),
+            parse_time(row.get('endTime')),
+            parse_duration(row.get('timeSpent')),
+            row.get('username') or '',
+        )
+
+    def to_row(self):
+        """Values in TASK_FIELDS order, formatted for csv.writer."""
+        return [
+            self.id, self.parent_id, self.text, self.level, str(self.completed),
+            self.currentEmotion, self.completionEmotion, self.totalTimeEstimate,
+            format_time(self.createdAt), format_time(self.startTime), format_time(self.endTime),
+            format_duration(self.timeSpent), self.username,
+        ]
+
+    @classmethod
+    def from_json(cls, data):
+        """From the dict the API returns and the journal stores."""
+        return cls(
+            to_int(data.get('id')),
+            to_int(data.get('parent_id')),
+            to_text(data.get('text')),
+            to_int(data.get('level')),
+            to_bool(data.get('completed')),
+            data.get('currentEmotion'),
+            data.get('completionEmotion'),
+            data.get('totalTimeEstimate'),
+            parse_time(data.get('createdAt')),
+            parse_time(data.get('startTime')),
+            parse_time(data.get('endTime')),
+            parse_duration(data.get('timeSpent')),
+            data.get('username') or '',
+        )
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'parent_id': self.parent_id,
+            'text': self.text,
+            'level': self.level,
+            'completed': self.completed,
+            'currentEmotion': self.currentEmotion,
+            'completionEmotion': self.completionEmotion,
+            'totalTimeEstimate': self.totalTimeEstimate,
+            'createdAt': format_time(self.createdAt),
+            'startTime': format_time(self.startTime),
+            'endTime': format_time(self.endTime),
+            'timeSpent': format_duration(self.timeSpent),
+            'username': self.username,
+        }
@@ -0,0 +1,338 @@
+import threading
+import time
+from collections import OrderedDict
+
+from rollups import Rollups
+from search_index import SearchIndex, index_tags, index_terms, tokenize
+
+# Deleted ids remembered per user for GET /tasks?since=; older clients get a full resync
+TOMBSTONE_LIMIT = 1000
+
+
+class TaskStore:
+    """In-memory task table indexed by (username, id) and by parent.
+
+    Tasks are task_model.Task records. Fields other than id, parent_id and
+    username can be edited in place; anything that moves a task in the
+    tree has to go through add() so the indexes follow.
+    In-place edits are reported with touch() so incremental sync sees them.
+
+    Every change gets a number from a store-wide clock, which starts at the
+    current time in microseconds so versions keep increasing across
+    reloads and restarts. A user's version is the clock value of their
+    latest change.
+
+    With a loader, tasks are fetched on first use instead of up front:
+    loader(username) for each user as they're touched, or, if per_user is
+    False, loader(None) once for everyone. len(), iteration and high_water
+    only cover what has been loaded so far.
+    """
+
+    def __init__(self, tasks=(), loader=None, per_user=True):
+        self._lock = threading.RLock()
+        # (username, id) -> task, in insertion order so snapshots keep the file order
+        self._tasks = {}
+        # username -> {id: task}
+        self._by_user = {}
+        # (username, parent_id) -> {child id: None}, an ordered set
+        self._children = {}
+        self.base_version = time.time_ns() // 1000
+        self._clock = self.base_version
+        # username -> OrderedDict of id -> version, oldest change first
+        self._changes = {}
+        self._tombstones = {}
+        # username -> newest version whose tombstones were dropped
+        self._horizon = {}
+        # Word and emotion tag index for search()
+        self._search = SearchIndex()
+        # Progress and time spent summed up each tree, for stats()
+        self._rollups = Rollups(self._tasks, self._children)
+        # Largest id ever inserted; removals don't lower it
+        self.high_water = 0
+        self._loader = loader
+        self._per_user = per_user
+        self._load_lock = threading.Lock()
+        self._loaded_users = set()
+        self._load(tasks)
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._tasks.values()))
+
+    def load_user(self, username):
+        """Make sure the user's tasks are in memory."""
+        if self._loader is None or username in self._loaded_users:
+            return
+        with self._load_lock:
+            loader = self._loader
+            if loader is None or username in self._loaded_users:
+                return
+            # Loading can be slow; readers of users already loaded carry on meanwhile
+            tasks = loader(username if self._per_user else None)
+            with self._lock:
+                self._load(tasks)
+                if self._per_user:
+                    self._loaded_users.add(username)
+                else:
+                    self._loader = None
+
+    def get(self, username, task_id):
+        self.load_user(username)
+        return self._tasks.get((username, task_id))
+
+    def user_tasks(self, username):
+        self.load_user(username)
+        with self._lock:
+            return list(self._by_user.get(username, {}).values())
+
+    def tree_order(self, username):
+        """The user's tasks with every parent before its children, one tree at a time."""
+        self.load_user(username)
+        with self._lock:
+            ordered = []
+            seen = set()
+            # Roots first; then anything whose parent is missing, with its own subtree
+            for start in list(self._children.get((username, 0), {})) + list(self._by_user.get(username, {})):
+                stack = [start]
+                while stack:
+                    tid = stack.pop()
+                    if tid in seen:
+                        continue
+                    seen.add(tid)
+                    ordered.append(self._tasks[(username, tid)])
+                    stack.extend(reversed(self._children.get((username, tid), {})))
+            return ordered
+
+    def children(self, username, task_id):
+        self.load_user(username)
+        with self._lock:
+            child_ids = self._children.get((username, task_id), {})
+            return [self._tasks[(username, cid)] for cid in child_ids]
+
+    def subtree_ids(self, username, task_id):
+        """Ids of a task and all of its descendants, walking only that tree."""
+        self.load_user(username)
+        with self._lock:
+            found = set()
+            stack = [task_id]
+            while stack:
+                tid = stack.pop()
+                if tid in found:
+                    continue
+                found.add(tid)
+                stack.extend(self._children.get((username, tid), ()))
+            return found
+
+    def add(self, task):
+        """Insert a task, or replace the one with the same (username, id)."""
+        self.load_user(task.username)
+        with self._lock:
+            self._add(task)
+
+    def add_all(self, tasks):
+        """add() every task as one change: all of them are checked before any goes in."""
+        for task in tasks:
+            self.check(task)
+        for username in {task.username for task in tasks}:
+            self.load_user(username)
+        with self._lock:
+            for task in tasks:
+                self._add(task)
+
+    def check(self, task):
+        """Raise if the indexes couldn't take task, e.g. text that isn't a string."""
+        index_terms(task)
+        index_tags(task)
+
+    def edit(self, task, **fields):
+        """Set fields on a stored task and update the indexes, as one change.
+
+        The new values are indexed on a copy first, so a value the indexes
+        can't take raises before the task or any index has changed.
+        """
+        with self._lock:
+            edited = task.copy()
+            for name, value in fields.items():
+                setattr(edited, name, value)
+            self.check(edited)
+            for name, value in fields.items():
+                setattr(task, name, value)
+            if self._tasks.get((task.username, task.id)) is task:
+                self._search.update(task)
+                self._rollups.update(task)
+                self._record(task.username, task.id)
+
+    def touch(self, tasks):
+        """Mark tasks that were edited in place as changed."""
+        with self._lock:
+            for task in tasks:
+                if self._tasks.get((task.username, task.id)) is task:
+                    self._search.update(task)
+                    self._rollups.update(task)
+                    self._record(task.username, task.id)
+
+    def search(self, username, query, level=None, completed=None, emotion=None, limit=20):
+        """Best matches for query among the user's tasks, as (task, score, ancestors).
+
+        Every word of the query has to appear in the task's text. Ancestors
+        run from the root of the tree down to the task's parent.
+        """
+        self.load_user(username)
+        with self._lock:
+            hits = self._search.search(username, tokenize(query), emotion.casefold() if emotion else None)
+            results = []
+            for task_id, score in hits:
+                task = self._tasks[(username, task_id)]
+                if level is not None and task.level != level:
+                    continue
+                if completed is not None and task.completed != completed:
+                    continue
+                results.append((task, score, self._ancestors(task)))
+                if len(results) >= limit:
+                    break
+            return results
+
+    def user_version(self, username):
+        return self._changes_version(username)
+
+    def changes_since(self, username, since):
+        """(version, changed tasks, deleted ids) after version since.
+
+        Returns None if since is too old to answer from what we remember,
+        in which case the client needs the full list.
+        """
+        with self._lock:
+            if since < self.base_version or since < self._horizon.get(username, 0):
+                return None
+            changed = []
+            for tid, version in reversed(self._changes.get(username, {}).items()):
+                if version <= since:
+                    break
+                changed.append(self._tasks[(username, tid)])
+            deleted = []
+            for tid, version in reversed(self._tombstones.get(username, {}).items()):
+                if version <= since:
+                    break
+                deleted.append(tid)
+            changed.reverse()
+            deleted.reverse()
+            return self._changes_version(username), changed, deleted
+
+    def stats(self, username, task_id=None):
+        """Rolled-up progress for the user, or for one task and its children.
+
+        Totals are [tasks, completed, seconds spent] over a task and
+        everything below it. Without task_id: the user's totals, emotion tag
+        histograms and each root task with its totals. With task_id: that
+        task and each direct child with their totals, or None if not found.
+        """
+        self.load_user(username)
+        with self._lock:
+            if task_id is None:
+                roots = self._children.get((username, 0), {})
+                return {
+                    'totals': self._rollups.user_totals(username),
+                    'emotions': self._rollups.emotions(username),
+                    'trees': [(self._tasks[(username, tid)], list(self._rollups.totals(username, tid)))
+                              for tid in roots],
+                }
+            task = self._tasks.get((username, task_id))
+            if task is None:
+                return None
+            return {
+                'task': (task, list(self._rollups.totals(username, task_id))),
+                'children': [(self._tasks[(username, cid)], list(self._rollups.totals(username, cid)))
+                             for cid in self._children.get((username, task_id), {})],
+            }
+
+    def remove_tree(self, username, task_id):
+        """Remove a task and its descendants. Returns the removed ids."""
+        # Load before taking _lock; load_user takes _load_lock first
+        self.load_user(username)
+        with self._lock:
+            ids = self.subtree_ids(username, task_id)
+            for tid in ids:
+                task = self._tasks.pop((username, tid), None)
+                if task is not None:
+                    self._unlink(task)
+                    self._record(username, tid, deleted=True)
+            return ids
+
+    def _load(self, tasks):
+        duplicates = 0
+        for task in tasks:
+            if (task.username, task.id) in self._tasks:
+                # Same rule as the old linear scans: the first row with an id wins
+                duplicates += 1
+                continue
+            self._insert(task)
+        if duplicates:
+            print(f"Skipped {duplicates} tasks with duplicate ids")
+
+    def _record(self, username, task_id, deleted=False):
+        self._clock = max(self._clock + 1, time.time_ns() // 1000)
+        live, dead = (self._tombstones, self._changes) if deleted else (self._changes, self._tombstones)
+        log = live.setdefault(username, OrderedDict())
+        log.pop(task_id, None)
+        log[task_id] = self._clock
+        if task_id in dead.get(username, {}):
+            del dead[username][task_id]
+        if deleted and len(log) > TOMBSTONE_LIMIT:
+            _, version = log.popitem(last=False)
+            self._horizon[username] = version
+
+    def _changes_version(self, username):
+        latest = self.base_version
+        for log in (self._changes.get(username), self._tombstones.get(username)):
+            if log:
+                latest = max(latest, next(reversed(log.values())))
+        return latest
+
+    def _ancestors(self, task):
+        chain = []
+        seen = {task.id}
+        # parent_id 0 marks a root
+        while task.parent_id and task.parent_id not in seen:
+            task = self._tasks.get((task.username, task.parent_id))
+            if task is None:
+                break
+            seen.add(task.id)
+            chain.append(task)
+        chain.reverse()
+        return chain
+
+    def _add(self, task):
+        old = self._tasks.get((task.username, task.id))
+        if old is not None:
+            self._unlink(old)
+        self._insert(task)
+        self._record(task.username, task.id)
+
+    def _insert(self, task):
+        self._search.add(task)
+        username = task.username
+        self._tasks[(username, task.id)] = task
+        if task.id > self.high_water:
+            self.high_water = task.id
+        self._by_user.setdefault(username, {})[task.id] = task
+        if task.parent_id != task.id:
+            self._children.setdefault((username, task.parent_id), {})[task.id] = None
+        self._rollups.add(task)
+
+    def _unlink(self, task):
+        self._search.remove(task)
+        self._rollups.remove(task)
+        username = task.username
+        user_tasks = self._by_user.get(username)
+        if user_tasks is not None:
+            user_tasks.pop(task.id, None)
+            if not user_tasks:
+                del self._by_user[username]
+        siblings = self._children.get((username, task.parent_id))
+        if siblings is not None:
+            siblings.pop(task.id, None)
+            if not siblings:
+                del self._children[(username, task.parent_id)]
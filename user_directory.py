@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+
+# How often, at most, to check whether another process changed the user table
+USERS_RECHECK_SECONDS = float(os.getenv('USERS_RECHECK_SECONDS', '1.0'))
+
+
+class UserDirectory:
+    """In-memory copy of the user table.
+
+    Lookups are plain dict reads. The backing store is only re-read when
+    its stamp changes (checked at most every USERS_RECHECK_SECONDS, or
+    straight away for a username we don't have). Our own signups and API
+    key changes update the copy in place, and the next lookup re-reads the
+    table for whatever other workers changed meanwhile.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._lock = threading.Lock()
+        self._users = {}
+        self._stamp = object()
+        self._checked_at = 0.0
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < USERS_RECHECK_SECONDS:
+            return
+        with self._lock:
+            self._checked_at = now
+            stamp = self.storage.users_stamp()
+            if stamp != self._stamp:
+                self._users = self.storage.load_users()
+                # load_users may create the file, so stamp again afterwards
+                self._stamp = self.storage.users_stamp()
+
+    def __len__(self):
+        return len(self._users)
+
+    def get(self, username):
+        self.refresh()
+        user = self._users.get(username)
+        if user is None:
+            # Maybe they just signed up through another worker
+            self.refresh(force=True)
+            user = self._users.get(username)
+        return user
+
+    def check_password(self, username, password):
+        user = self.get(username)
+        return user is not None and user['password'] == password
+
+    def api_key(self, username):
+        user = self.get(username)
+        return user['api_key'] if user else ''
+
+    def add(self, username, password):
+        """Create a user. Returns False if the username is taken."""
+        if self.get(username) is not None:
+            return False
+        with self._lock:
+            if not self.storage.add_user(username, password):
+                return False
+            self._users[username] = {'password': password, 'api_key': ''}
+            self._stale()
+        return True
+
+    def update_api_key(self, username, api_key):
+        """Returns False if the user doesn't exist."""
+        with self._lock:
+            if not self.storage.update_user_api_key(username, api_key):
+                return False
+            self._users.setdefault(username, {'password': '', 'api_key': ''})['api_key'] = api_key
+            self._stale()
+        return True
+
+    def _stale(self):
+        # The stamp after our write would also cover other workers' writes we
+        # haven't loaded, so don't keep it; reload on the next lookup instead
+        self._stamp = object()
+        self._checked_at = 0.0